@@ -0,0 +1,213 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+# An in-process stand-in for taskw's TaskWarrior client, for benchmarks.
+# It keeps tasks in memory, records every call, and sleeps for as many
+# `task` forks as the real client would make, so runs can be compared
+# offline without a `task` binary.
+
+from calendar import timegm
+from collections import Counter
+from copy import deepcopy
+from datetime import datetime, timezone
+from json import load
+from os import path
+from time import sleep, strptime
+from uuid import uuid4
+
+from taskw.exceptions import TaskwarriorError
+
+EXPORT_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+DATE_ATTRIBUTES = ("entry", "start", "end", "due", "until", "wait",
+                   "scheduled", "modified")
+
+UDAS = {"twi_hash": {"type": "string"},
+        "twi_file": {"type": "string"},
+        "twi_line": {"type": "numeric"},
+        "twi_repo": {"type": "string"},
+        "effort": {"type": "numeric"},
+        "pom": {"type": "numeric"},
+        "imask": {"type": "numeric"}}
+
+# `task` runs behind each client call. task_update looks the task up
+# before and after modifying it.
+FORKS = {"load_tasks": 2, "task_add": 2, "task_update": 3}
+
+
+def now():
+    return datetime.now(timezone.utc).strftime(EXPORT_DATE_FORMAT)
+
+
+def to_ff4_value(name, value):
+    if name in DATE_ATTRIBUTES:
+        return str(timegm(strptime(value, EXPORT_DATE_FORMAT)))
+    elif isinstance(value, list):
+        value = ",".join(value)
+
+    return (str(value).replace('"', "&dquot;").replace("[", "&open;")
+            .replace("]", "&close;"))
+
+
+class FakeTaskWarrior:
+    def __init__(self, location, latency=0.0, marshal=False):
+        self.config = {"data": {"location": location}, "uda": UDAS}
+        self.config_filename = path.join(location, "taskrc")
+        self.latency = latency
+
+        self.tasks = {}
+        self.ids = None
+        self.calls = Counter()
+        self.forks = 0
+
+    def fork(self, method):
+        count = FORKS.get(method, 1)
+        self.calls[method] += 1
+        self.forks += count
+        if self.latency:
+            sleep(self.latency * count)
+
+    def get_ids(self):
+        # Pending tasks are numbered in the order they were added
+        if self.ids is None:
+            pending = [uuid for uuid, task in self.tasks.items()
+                       if task["status"] in ("pending", "waiting")]
+            self.ids = {uuid: number + 1
+                        for number, uuid in enumerate(pending)}
+
+        return self.ids
+
+    def export(self, task):
+        record = deepcopy(task)
+        record["id"] = self.get_ids().get(task["uuid"], 0)
+        return record
+
+    def write(self, task):
+        task.setdefault("status", "pending")
+        task.setdefault("entry", now())
+        task["modified"] = now()
+        self.tasks[task["uuid"]] = task
+        self.ids = None
+
+    def find(self, **kw):
+        ((name, value),) = kw.items()
+        if name == "id":
+            ids = self.get_ids()
+            for uuid, number in ids.items():
+                if str(number) == str(value):
+                    return self.tasks[uuid]
+            return None
+
+        for task in self.tasks.values():
+            if str(task.get(name, None)) == str(value):
+                return task
+        return None
+
+    def load_tasks(self, command="all"):
+        self.fork("load_tasks")
+        statuses = {"pending": ("pending", "waiting"),
+                    "completed": ("completed",)}
+        if command != "all":
+            statuses = {command: statuses[command]}
+
+        return {name: [self.export(task) for task in self.tasks.values()
+                       if task["status"] in wanted]
+                for name, wanted in statuses.items()}
+
+    def get_task(self, **kw):
+        self.fork("get_task")
+        task = self.find(**kw)
+        if not task:
+            return None, {}
+
+        record = self.export(task)
+        return record["id"] or None, record
+
+    def _get_json(self, *args):
+        self.fork("_get_json")
+        # Only UUIDs and status:STATUS are understood as filters
+        uuids = set(arg for arg in args if arg in self.tasks)
+        statuses = set(arg[7:] for arg in args if arg.startswith("status:"))
+
+        return [self.export(task) for task in self.tasks.values()
+                if (not uuids or task["uuid"] in uuids)
+                and (not statuses or task["status"] in statuses)]
+
+    def _get_task_object(self, task):
+        return task
+
+    def _execute(self, *args):
+        self.fork("_execute")
+        if args[0] != "import":
+            raise TaskwarriorError(["task"] + list(args), b"Unsupported",
+                                   b"", 1)
+
+        with open(args[1], "r") as import_file:
+            for record in load(import_file):
+                self.write(dict(record))
+
+        return "", ""
+
+    def task_add(self, description, tags=None, **kw):
+        self.fork("task_add")
+        task = dict(kw, description=description, uuid=str(uuid4()))
+        if tags:
+            task["tags"] = list(tags)
+        self.write(task)
+        return self.export(task)
+
+    def task_update(self, task):
+        self.fork("task_update")
+        if task["uuid"] not in self.tasks:
+            raise TaskwarriorError(["task"], b"No such task", b"", 1)
+
+        record = dict(self.tasks[task["uuid"]])
+        record.update((key, value) for key, value in task.items()
+                      if key not in ("id", "urgency"))
+        self.write(record)
+        return record["uuid"], self.export(record)
+
+    def set_status(self, status, **kw):
+        task = self.find(**kw)
+        if task:
+            task["status"] = status
+            task["end"] = now()
+            self.ids = None
+
+    def task_done(self, **kw):
+        self.fork("task_done")
+        self.set_status("completed", **kw)
+
+    def task_delete(self, **kw):
+        self.fork("task_delete")
+        self.set_status("deleted", **kw)
+
+    def save(self):
+        # Write the tasks out in Taskwarrior 2.x's format, to benchmark
+        # reading the data files directly
+        location = self.config["data"]["location"]
+        data_files = {"pending.data": ("pending", "waiting"),
+                      "completed.data": ("completed", "deleted")}
+
+        for data_file, statuses in data_files.items():
+            with open(path.join(location, data_file), "w") as out:
+                for task in self.tasks.values():
+                    if task["status"] not in statuses:
+                        continue
+                    attributes = " ".join(
+                        f'{name}:"{to_ff4_value(name, value)}"'
+                        for name, value in sorted(task.items()))
+                    out.write(f"[{attributes}]\n")
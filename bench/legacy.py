@@ -0,0 +1,191 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Reference copies of the parsers as they were before they were rewritten
+# for speed. The benchmarks check the current code against these.
+
+from re import finditer, search, sub
+
+
+def parse_line(line):
+    description = line
+    task_data = {}
+
+    try:
+        task_data["priority"] = search(r"^\((\w+)\)", line).group(1)
+        description = sub(r"^\(\w+\)", "", description)
+    except AttributeError:
+        pass
+
+    try:
+        task_data["project"] = search(r"\+(\S+)", line).group(1)
+        description = sub(r"\+\S+", "", description)
+    except AttributeError:
+        pass
+
+    task_data["tags"] = []
+    for match in finditer(r"@(\S+)", line):
+        try:
+            task_data["tags"].append(match.group(1))
+        except AttributeError:
+            pass
+
+    description = sub(r"@\S+", "", description)
+
+    for match in finditer(r"(\w+):(\S+)", line):
+        try:
+            task_data[match.group(1)] = match.group(2)
+        except (AttributeError, IndexError):
+            pass
+
+    description = sub(r"\w+:\S+", "", description)
+    description = description.strip()
+
+    return description, task_data
+
+
+def parse_org_mode(org_file_path):
+    # Read the org file into memory
+    with open(org_file_path, "r") as org_file:
+        org_text = org_file.read()
+
+    prop = False
+    tasks = ""
+    todo = ""
+    for line in org_text.split("\n"):
+        try:
+            # Check for a new to do entry
+            todo_check = search(r"\*+ +TODO +(.*)", line)
+
+            # If we have an existing to do entry, commit it
+            if todo_check:
+
+                if todo != "":
+                    tasks += todo + "\n"
+
+                todo = todo_check.group(1).strip()
+
+                try:
+                    priority = search(r"(\[#[ABCDEF]\])", todo).group(1)
+                    todo = sub(r"\[#[ABCDEF]\]", "", todo).strip()
+
+                    if priority == "[#A]":
+                        todo = "(U) " + todo
+                    elif priority == "[#B]":
+                        todo = "(H) " + todo
+                    elif priority == "[#C]":
+                        todo = "(M) " + todo
+                    elif priority == "[#E]":
+                        todo = "(L) " + todo
+                    elif priority == "[#F]":
+                        todo = "(T) " + todo
+                    else:
+                        todo = "(N) " + todo
+                except AttributeError:
+                    todo = "(N) " + todo
+
+                try:
+                    tags = search(r":(\S+):", todo).group(1)
+                    tags = tags.split(":")
+                    todo = sub(r":\S+:", "", todo)
+                    todo = todo.strip()
+
+                    for tag in tags:
+                        todo += " @" + tag
+                except AttributeError:
+                    todo += " @home"
+
+        except AttributeError:
+            pass
+
+        if not todo_check and todo != "":
+            match = False
+
+            # Check for the start of the PROPERTIES drawer
+            tag = search(r"\s*:PROPERTIES:\s*", line)
+            if tag:
+                continue
+
+            # Check for the end of the PROPERTIES drawer
+            tag = search(r"\s*:END:\s*", line)
+            if tag:
+                tasks += todo + "\n"
+                todo = ""
+                continue
+
+            # Look for a deadline
+            try:
+                deadline = search(r".*DEADLINE: *<(\d{4}-\d{2}-\d{2}) "
+                                  r"\w{3} ?(\d{2}:\d{2})?>", line)
+                due_date = deadline.group(1)
+                due_time = deadline.group(2)
+                match = True
+
+                if due_date and due_time:
+                    todo += " due:" + due_date + "T" + due_time
+                elif due_date:
+                    todo += " due:" + due_date
+            except AttributeError:
+                pass
+
+            # Look for a scheduled date
+            try:
+                scheduled = search(r".*SCHEDULED: *<(\d{4}-\d{2}-\d{2}) "
+                                   r"\w{3} ?(\d{2}:\d{2})?>", line)
+                sched_date = scheduled.group(1)
+                sched_time = scheduled.group(2)
+                match = True
+
+                if sched_date and sched_time:
+                    todo += " scheduled:" + sched_date + "T" + sched_time
+                elif sched_date:
+                    todo += " scheduled:" + sched_date
+            except AttributeError:
+                pass
+
+            try:
+                org_prop = search(r"\s*:project:\s*(.*)", line)
+
+                proj_name = org_prop.group(1)
+                match = True
+
+                todo += " +" + proj_name
+            except AttributeError:
+                pass
+
+            # Look for any properties tags
+            if not match:
+                try:
+                    org_prop = search(r"\s*:(.+?):\s*(.*)", line)
+
+                    prop_tag = org_prop.group(1).lower()
+                    prop_val = org_prop.group(2)
+                    match = True
+
+                    todo += " " + prop_tag + ":" + prop_val
+                except AttributeError:
+                    pass
+
+            if not match and line.strip() != "":
+                tasks += todo + "\n"
+                todo = ""
+
+    if todo != "":
+        tasks += todo + "\n"
+
+    # The TODO -> TASKED rewrite is left out, so the reference parser can be
+    # run over the same corpus as many times as needed.
+    return tasks
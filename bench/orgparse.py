@@ -0,0 +1,167 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Org parser benchmark
+
+Usage:
+  orgparse.py [--size=MB] [--files=N] [--seed=SEED] [--dir=DIR]
+
+Options:
+  --size=MB      Size of the generated org corpus in megabytes [default: 100].
+  --files=N      Number of org files to spread the corpus over [default: 50].
+  --seed=SEED    Seed for the corpus generator [default: 0].
+  --dir=DIR      Keep the corpus in DIR instead of a temporary directory.
+"""
+
+from os import makedirs, path
+from random import Random
+from sys import exit, path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from docopt import docopt
+
+from legacy import parse_org_mode as legacy_parse_org_mode
+from parse import parse_org_mode
+
+WORDS = ("call", "mom", "fix", "the", "leaky", "faucet", "write", "report",
+         "on", "q3", "numbers", "buy", "milk", "and", "eggs", "review",
+         "pull", "request", "for", "parser", "book", "flights")
+KEYWORDS = ("TODO", "TODO", "TODO", "DONE", "NEXT", "")
+TAGS = ("work", "home", "errand", "phone", "inbox")
+PROPERTIES = ("EFFORT", "CATEGORY", "ID", "LOCATION")
+
+
+def words(rand, low, high):
+    count = rand.randint(low, high)
+    return " ".join(rand.choice(WORDS) for _ in range(count))
+
+
+def timestamp(rand):
+    date = f"2018-{rand.randint(1, 12):02}-{rand.randint(1, 28):02} Mon"
+    if rand.random() < 0.3:
+        date += f" {rand.randint(0, 23):02}:{rand.choice((0, 15, 30)):02}"
+    return f"<{date}>"
+
+
+def generate_entry(rand):
+    level = "*" * rand.randint(1, 4)
+    keyword = rand.choice(KEYWORDS)
+    headline = " ".join(part for part in (level, keyword) if part) + " "
+
+    if rand.random() < 0.5:
+        headline += f"[#{rand.choice('ABCDEF')}] "
+    headline += words(rand, 2, 8)
+    if rand.random() < 0.5:
+        headline += " :" + ":".join(rand.sample(TAGS, rand.randint(1, 3))) \
+                    + ":"
+
+    lines = [headline]
+
+    planning = []
+    if rand.random() < 0.3:
+        planning.append("DEADLINE: " + timestamp(rand))
+    if rand.random() < 0.3:
+        planning.append("SCHEDULED: " + timestamp(rand))
+    if planning:
+        lines.append(" ".join(planning))
+
+    if rand.random() < 0.4:
+        lines.append(":PROPERTIES:")
+        if rand.random() < 0.5:
+            project = f"{rand.choice(WORDS)}.{rand.choice(WORDS)}"
+            lines.append(f":project: {project}")
+        for prop in rand.sample(PROPERTIES, rand.randint(0, 2)):
+            lines.append(f":{prop}: {rand.randint(1, 99)}")
+        lines.append(":END:")
+
+    for _ in range(rand.randint(0, 4)):
+        if rand.random() < 0.1:
+            lines.append("Note: " + words(rand, 1, 6) + " :-)")
+        else:
+            lines.append(words(rand, 0, 12))
+
+    return "\n".join(lines) + "\n"
+
+
+def generate_corpus(directory, size, files, seed=0):
+    rand = Random(seed)
+    per_file = size // files
+
+    org_files = []
+    for number in range(files):
+        org_file_path = path.join(directory, f"corpus-{number:04}.org")
+        written = 0
+
+        with open(org_file_path, "w") as org_file:
+            while written < per_file:
+                entry = generate_entry(rand)
+                org_file.write(entry)
+                written += len(entry)
+
+        org_files.append(org_file_path)
+
+    return org_files
+
+
+def run(org_files, parser):
+    start = perf_counter()
+    tasks = [parser(org_file) for org_file in org_files]
+    return tasks, perf_counter() - start
+
+
+def benchmark(directory, arguments):
+    size = int(float(arguments["--size"]) * 1024 * 1024)
+    files = int(arguments["--files"])
+    org_files = generate_corpus(directory, size, files,
+                                int(arguments["--seed"]))
+
+    legacy_tasks, legacy_time = run(org_files, legacy_parse_org_mode)
+    tasks, current_time = run(
+        org_files,
+        lambda org_file: "".join(task + "\n" for task in
+                                 parse_org_mode(org_file)))
+
+    mismatches = 0
+    for org_file, expected, actual in zip(org_files, legacy_tasks, tasks):
+        if expected != actual:
+            mismatches += 1
+            print(f"MISMATCH: {org_file}")
+
+    megabytes = size / (1024 * 1024)
+    print(f"{megabytes:.0f} MB in {files} files, "
+          f"{sum(task.count(chr(10)) for task in tasks)} tasks, "
+          f"{mismatches} mismatched files")
+    print(f"legacy:  {megabytes / legacy_time:8.1f} MB/sec")
+    print(f"current: {megabytes / current_time:8.1f} MB/sec "
+          f"({legacy_time / current_time:.1f}x)")
+
+    return mismatches
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+
+    if arguments["--dir"]:
+        makedirs(arguments["--dir"], exist_ok=True)
+        mismatches = benchmark(arguments["--dir"], arguments)
+    else:
+        with TemporaryDirectory() as directory:
+            mismatches = benchmark(directory, arguments)
+
+    exit(1 if mismatches else 0)
@@ -0,0 +1,353 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""Pipeline benchmark
+
+Runs each stage of twinput against generated corpora (todo lines, org
+trees and git repositories) and an in-process fake Taskwarrior that
+simulates the cost of forking `task`. Reports throughput, Taskwarrior
+calls and peak memory per stage, and can save the results or compare
+them against saved ones.
+
+Usage:
+  pipeline.py [options]
+
+Options:
+  --lines=N          Generated todo lines [default: 20000].
+  --per-line=N       Lines for the add/modify path [default: 200].
+  --org-size=MB      Size of the generated org corpus [default: 5].
+  --org-files=N      Files to spread the org corpus over [default: 50].
+  --repos=N          Generated git repositories [default: 4].
+  --repo-files=N     Source files per repository [default: 100].
+  --latency=MS       Simulated time per `task` fork [default: 10].
+  --seed=SEED        Seed for the generators [default: 0].
+  --stage=NAME       Only run stages whose name contains NAME.
+  --no-memory        Don't measure peak memory (a second run per stage).
+  --save=FILE        Write the results to FILE as JSON.
+  --baseline=FILE    Compare against results saved with --save.
+  --tolerance=PCT    Throughput drop counted as a regression [default: 20].
+"""
+
+from json import dump, load
+from os import environ, listdir, makedirs, path
+from random import Random
+from subprocess import DEVNULL, run
+from sys import exit, path as sys_path
+from tempfile import TemporaryDirectory, mkdtemp
+from time import perf_counter
+from tracemalloc import get_traced_memory, start, stop
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from docopt import docopt
+
+from fakewarrior import UDAS, FakeTaskWarrior
+from orgparse import generate_corpus
+from tokenizer import WORDS, generate_lines
+from parse import (git_grep_repos, parse_line, parse_todos, read_pim,
+                   save_git_scans)
+from taskdata import DirectTaskWarrior, TaskData
+
+LANGUAGES = (("py", "#"), ("c", "//"), ("sh", "#"), ("js", "//"))
+TODO_CHANCE = 0.05
+CODE_LINES = 200
+LOOKUPS = 200
+
+
+def generate_repos(directory, count, files, seed=0):
+    rand = Random(seed)
+
+    repos = []
+    for number in range(count):
+        repo = path.join(directory, f"repo-{number:02}")
+        makedirs(repo)
+        with open(path.join(repo, ".twparse"), "w") as template:
+            template.write(f"${{TODO}} +repo{number} @code\n")
+
+        for file_number in range(files):
+            extension, comment = rand.choice(LANGUAGES)
+            source_name = f"source-{file_number:03}.{extension}"
+            with open(path.join(repo, source_name), "w") as source:
+                for _ in range(CODE_LINES):
+                    if rand.random() < TODO_CHANCE:
+                        todo = " ".join(rand.sample(WORDS, 4))
+                        source.write(f"    {comment} TODO: {todo}\n")
+                    else:
+                        source.write(f"    value = {rand.random()}\n")
+
+        git(repo, "init")
+        git(repo, "add", ".")
+        git(repo, "commit", "-m", "Generated")
+        repos.append(repo)
+
+    return repos
+
+
+def git(directory, *args):
+    run(["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+        + list(args), cwd=directory, stdout=DEVNULL, stderr=DEVNULL,
+        check=True)
+
+
+class Corpora:
+    def __init__(self, directory, arguments):
+        self.directory = directory
+        self.latency = float(arguments["--latency"]) / 1000
+        seed = int(arguments["--seed"])
+
+        self.lines = list(generate_lines(int(arguments["--lines"]), seed))
+        self.per_line = self.lines[:int(arguments["--per-line"])]
+
+        self.org_dir = path.join(directory, "org")
+        makedirs(self.org_dir)
+        generate_corpus(self.org_dir,
+                        int(float(arguments["--org-size"]) * 1024 * 1024),
+                        int(arguments["--org-files"]), seed)
+
+        self.repos = generate_repos(path.join(directory, "repos"),
+                                    int(arguments["--repos"]),
+                                    int(arguments["--repo-files"]), seed)
+
+    def new_fake(self, lines=()):
+        # A fresh Taskwarrior for every run, holding the given lines
+        fake = FakeTaskWarrior(mkdtemp(dir=self.directory))
+        if lines:
+            parse_todos(fake, lines)
+        fake.calls.clear()
+        fake.forks = 0
+        fake.latency = self.latency
+        return fake
+
+
+# Each stage does its setup and returns the work to time, which returns
+# the number of items it handled and the fake Taskwarrior it used
+
+def tokenize(corpora):
+    def work():
+        for line in corpora.lines:
+            parse_line(line)
+        return len(corpora.lines), None
+    return work
+
+
+def import_batch(corpora):
+    fake = corpora.new_fake()
+
+    def work():
+        parse_todos(fake, corpora.lines)
+        return len(corpora.lines), fake
+    return work
+
+
+def import_per_line(corpora):
+    fake = corpora.new_fake()
+
+    def work():
+        parse_todos(fake, corpora.per_line, batch=False)
+        return len(corpora.per_line), fake
+    return work
+
+
+def import_unchanged(corpora):
+    fake = corpora.new_fake(corpora.lines)
+
+    def work():
+        parse_todos(fake, corpora.lines)
+        return len(corpora.lines), fake
+    return work
+
+
+def org_parse(corpora):
+    def work():
+        return len(list(read_pim(corpora.org_dir))), None
+    return work
+
+
+def org_import(corpora):
+    fake = corpora.new_fake()
+
+    def work():
+        lines = list(read_pim(corpora.org_dir))
+        parse_todos(fake, lines)
+        return len(lines), fake
+    return work
+
+
+def git_grep_full(corpora):
+    def work():
+        return len(list(git_grep_repos(corpora.repos, full=True))), None
+    return work
+
+
+def git_grep_incremental(corpora):
+    # One file edited since the last scan
+    scans = []
+    list(git_grep_repos(corpora.repos, scans=scans))
+    save_git_scans(scans)
+    source_name = min(name for name in listdir(corpora.repos[0])
+                      if name.startswith("source-"))
+    with open(path.join(corpora.repos[0], source_name), "a") as source:
+        source.write("    // TODO: one more thing\n")
+
+    def work():
+        return len(list(git_grep_repos(corpora.repos))), None
+    return work
+
+
+def read_export(corpora):
+    fake = corpora.new_fake(corpora.lines)
+
+    def work():
+        return len(fake.load_tasks("pending")["pending"]), fake
+    return work
+
+
+def read_direct(corpora):
+    fake = corpora.new_fake(corpora.lines)
+    fake.save()
+
+    def work():
+        # Cold, the data file is parsed every time
+        backend = DirectTaskWarrior(
+            fake, TaskData(fake.config["data"]["location"], UDAS))
+        return len(backend.load_tasks("pending")["pending"]), fake
+    return work
+
+
+def lookup_export(corpora):
+    fake = corpora.new_fake(corpora.lines)
+
+    def work():
+        for task_id in range(1, LOOKUPS + 1):
+            fake.get_task(id=task_id)
+        return LOOKUPS, fake
+    return work
+
+
+def lookup_direct(corpora):
+    fake = corpora.new_fake(corpora.lines)
+    fake.save()
+    backend = DirectTaskWarrior(
+        fake, TaskData(fake.config["data"]["location"], UDAS))
+    backend.load_tasks("pending")
+
+    def work():
+        for task_id in range(1, LOOKUPS + 1):
+            backend.get_task(id=task_id)
+        return LOOKUPS, fake
+    return work
+
+
+STAGES = (("tokenize", tokenize),
+          ("import: batch", import_batch),
+          ("import: per line", import_per_line),
+          ("import: unchanged", import_unchanged),
+          ("org: parse", org_parse),
+          ("org: import", org_import),
+          ("git grep: full", git_grep_full),
+          ("git grep: incremental", git_grep_incremental),
+          ("read: task export", read_export),
+          ("read: data files", read_direct),
+          ("lookup: task export", lookup_export),
+          ("lookup: data files", lookup_direct))
+
+
+def run_stage(stage, corpora, memory=True):
+    work = stage(corpora)
+    begin = perf_counter()
+    items, fake = work()
+    seconds = perf_counter() - begin
+
+    result = {"items": items,
+              "seconds": seconds,
+              "rate": items / seconds if seconds else 0.0,
+              "forks": fake.forks if fake else 0,
+              "calls": dict(fake.calls) if fake else {},
+              "peak": None}
+
+    # Tracing slows everything down, so memory gets a run of its own
+    if memory:
+        work = stage(corpora)
+        start()
+        try:
+            work()
+            result["peak"] = get_traced_memory()[1]
+        finally:
+            stop()
+
+    return result
+
+
+def print_result(name, result):
+    peak = result["peak"]
+    peak = f"{peak / (1024 * 1024):7.1f}MB" if peak is not None else ""
+    calls = " ".join(f"{method}:{count}"
+                     for method, count in sorted(result["calls"].items()))
+
+    print(f"{name:<22} {result['items']:>7} {result['seconds']:8.3f}s "
+          f"{result['rate']:12,.0f}/s {result['forks']:>6} {peak:>9}  "
+          f"{calls}")
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        old = baseline[name]
+        if result["rate"] < old["rate"] * (1 - tolerance / 100):
+            regressions.append(f"{name}: {result['rate']:,.0f}/s, was "
+                               f"{old['rate']:,.0f}/s")
+        if result["forks"] > old["forks"]:
+            regressions.append(f"{name}: {result['forks']} task forks, was "
+                               f"{old['forks']}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+
+    with TemporaryDirectory() as directory:
+        # Keep the org manifest and scan state out of the real cache
+        environ["XDG_CACHE_HOME"] = path.join(directory, "cache")
+        corpora = Corpora(directory, arguments)
+
+        print(f"{'stage':<22} {'items':>7} {'time':>9} {'throughput':>14} "
+              f"{'forks':>6} {'peak':>9}  calls")
+        results = {}
+        for name, stage in STAGES:
+            if arguments["--stage"] and arguments["--stage"] not in name:
+                continue
+            results[name] = run_stage(stage, corpora,
+                                      not arguments["--no-memory"])
+            print_result(name, results[name])
+
+    if arguments["--save"]:
+        with open(arguments["--save"], "w") as save_file:
+            dump(results, save_file, indent=2)
+
+    regressions = []
+    if arguments["--baseline"]:
+        with open(arguments["--baseline"], "r") as baseline_file:
+            regressions = compare(results, load(baseline_file),
+                                  float(arguments["--tolerance"]))
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+
+    exit(1 if regressions else 0)
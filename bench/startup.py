@@ -0,0 +1,115 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""CLI startup benchmark
+
+Times each twinput mode's startup, and fails if one of the quick modes
+(--help, --version and the socket clients) starts importing any of the
+heavy modules again.
+
+Usage:
+  startup.py [--runs=N]
+
+Options:
+  --runs=N    Runs of each command to take the median of [default: 10].
+"""
+
+from os import environ, path
+from statistics import median
+from subprocess import PIPE, run
+from sys import executable, exit
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from docopt import docopt
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+TWINPUT = path.join(ROOT, "twinput.py")
+
+# Modes that must never load Taskwarrior, curses or the parsers
+QUICK_MODES = (("help", ["--help"]),
+               ("version", ["--version"]),
+               ("pomodoro client", ["--pom-status"]))
+HEAVY_MODULES = ("taskw", "curses", "asyncio", "sqlite3", "parse",
+                 "interactive", "pomodoro", "server", "taskdata")
+
+# What the other modes import once they know what they're doing. They
+# need a Taskwarrior to run for real, so only their imports are timed.
+MODE_IMPORTS = (("import (-f, -g, -o)", "parse, taskdata, taskw"),
+                ("interactive", "curses, interactive"),
+                ("pomodoro", "curses, pomodoro"),
+                ("server", "server"))
+
+
+def run_python(args, env):
+    start = perf_counter()
+    result = run([executable] + args, cwd=ROOT, env=env, stdout=PIPE,
+                 stderr=PIPE, universal_newlines=True)
+    return perf_counter() - start, result.stderr
+
+
+def get_imports(importtime):
+    # -X importtime lines are "import time: self | cumulative | name", with
+    # the name indented by nesting depth
+    imports = {}
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        imports[name.strip()] = (int(cumulative),
+                                 len(name) - len(name.lstrip()) == 1)
+
+    return imports
+
+
+def time_command(args, runs, env):
+    _, importtime = run_python(["-X", "importtime"] + args, env)
+    imports = get_imports(importtime)
+    total = sum(cumulative for cumulative, top in imports.values() if top)
+
+    wall = median(run_python(args, env)[0] for _ in range(runs))
+    return wall, total, imports
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    runs = int(arguments["--runs"])
+
+    regressions = []
+    with TemporaryDirectory() as runtime_dir:
+        # Never reach a daemon that happens to be running
+        env = dict(environ, XDG_RUNTIME_DIR=runtime_dir)
+
+        print(f"{'mode':<22} {'wall':>9} {'imports':>9}")
+        for mode, args in QUICK_MODES:
+            wall, total, imports = time_command([TWINPUT] + args, runs, env)
+            print(f"{mode:<22} {wall * 1000:7.1f}ms {total / 1000:7.1f}ms")
+
+            heavy = [name for name in HEAVY_MODULES if name in imports]
+            if heavy:
+                regressions.append(f"{mode} imports {', '.join(heavy)}")
+
+        for mode, modules in MODE_IMPORTS:
+            wall, total, _ = time_command(["-c", f"import {modules}"], runs,
+                                          env)
+            print(f"{mode:<22} {wall * 1000:7.1f}ms {total / 1000:7.1f}ms")
+
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+
+    exit(1 if regressions else 0)
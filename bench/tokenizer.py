@@ -0,0 +1,108 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Todo line tokenizer benchmark
+
+Usage:
+  tokenizer.py [--lines=N] [--seed=SEED]
+
+Options:
+  --lines=N      Number of generated todo lines [default: 200000].
+  --seed=SEED    Seed for the line generator [default: 0].
+"""
+
+from os import path
+from random import Random
+from sys import exit, path as sys_path
+from time import perf_counter
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from docopt import docopt
+
+from legacy import parse_line as legacy_parse_line
+from parse import get_task_data, parse_line
+
+WORDS = ("call", "mom", "fix", "the", "leaky", "faucet", "write", "report",
+         "on", "q3", "numbers", "buy", "milk", "and", "eggs", "review",
+         "pull", "request", "for", "parser", "book", "flights")
+PRIORITIES = ("U", "H", "M", "N", "L", "T")
+CONTEXTS = ("home", "work", "errand", "inbox", "phone")
+PROJECTS = ("house", "work.reports", "family", "twinput", "travel.2018")
+ATTRIBUTES = ("due:2018-06-01", "scheduled:2018-05-30T09:00", "effort:3",
+              "twi_file:parse.py", "twi_line:120", "wait:2018-05-01")
+
+
+def generate_lines(count, seed=0):
+    rand = Random(seed)
+
+    for _ in range(count):
+        tokens = rand.sample(WORDS, rand.randint(2, 8))
+
+        for _ in range(rand.randint(0, 3)):
+            tokens.insert(rand.randint(1, len(tokens)),
+                          "@" + rand.choice(CONTEXTS))
+        if rand.random() < 0.6:
+            tokens.insert(rand.randint(1, len(tokens)),
+                          "+" + rand.choice(PROJECTS))
+        for attribute in rand.sample(ATTRIBUTES, rand.randint(0, 3)):
+            tokens.insert(rand.randint(1, len(tokens)), attribute)
+
+        line = " ".join(tokens)
+        if rand.random() < 0.7:
+            line = f"({rand.choice(PRIORITIES)}) " + line
+
+        yield line
+
+
+def check(lines):
+    mismatches = 0
+    for line in lines:
+        parsed = parse_line(line)
+        current = (parsed.description, get_task_data(parsed))
+
+        if current != legacy_parse_line(line):
+            mismatches += 1
+            if mismatches <= 10:
+                print(f"MISMATCH: {line}")
+                print(f"  legacy:  {legacy_parse_line(line)}")
+                print(f"  current: {current}")
+
+    return mismatches
+
+
+def time_parser(parser, lines):
+    start = perf_counter()
+    for line in lines:
+        parser(line)
+    return len(lines) / (perf_counter() - start)
+
+
+if __name__ == "__main__":
+    arguments = docopt(__doc__)
+    lines = list(generate_lines(int(arguments["--lines"]),
+                                int(arguments["--seed"])))
+
+    mismatches = check(lines)
+    print(f"{len(lines)} lines, {mismatches} mismatches")
+
+    legacy_rate = time_parser(legacy_parse_line, lines)
+    current_rate = time_parser(parse_line, lines)
+    print(f"legacy:  {legacy_rate:12,.0f} lines/sec")
+    print(f"current: {current_rate:12,.0f} lines/sec "
+          f"({current_rate / legacy_rate:.1f}x)")
+
+    exit(1 if mismatches else 0)
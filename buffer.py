@@ -14,7 +14,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from tempfile import NamedTemporaryFile
-from subprocess import call
+from subprocess import Popen, call
 
 
 def get_header(version):
@@ -68,6 +68,17 @@ def open_file_buffer(initial_message, editor="vim"):
         #    if tf.read() != initial_message:
         #        break
 
+        # NOTE: GUI editors that return straight away are better served by
+        #       --watch (see start_file_buffer below)
+
         tf.seek(0)
         return tf.read().decode("utf-8")
 
+
+def start_file_buffer(initial_message, editor="vim"):
+    # Open the editor without waiting on it, for --watch to follow the file
+    # as it's saved. The caller removes the file when done.
+    with NamedTemporaryFile(suffix=".tmp", delete=False) as tf:
+        tf.write(initial_message)
+
+    return tf.name, Popen([editor, tf.name])
@@ -0,0 +1,149 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# Opt-in timing for --profile. Nothing here runs unless enable() is
+# called: it wraps the pipeline stages, the Taskwarrior clients and the
+# subprocesses they start in place, so a normal run pays nothing at all.
+
+from functools import wraps
+from importlib import import_module
+from inspect import isgeneratorfunction
+from json import dumps
+from sys import stderr
+from threading import Lock
+from time import perf_counter, time
+
+# (module, function, stage name) for everything timed. Names that were
+# imported with `from x import y` before enable() ran are wrapped where
+# they were imported to as well.
+STAGES = (("parse", "git_grep_repos", "git grep (all repositories)"),
+          ("parse", "git_grep_todos", "git grep"),
+          ("parse", "read_pim", "org: read PIM directory"),
+          ("parse", "parse_org_mode", "org: parse file"),
+          ("parse", "mark_org_todos", "org: mark imported headlines"),
+          ("parse", "parse_todos", "parse_todos"),
+          ("parse", "complete_todos", "complete_todos"),
+          ("parse", "import_tasks", "task import"),
+          ("parse", "git", "git (subprocess)"),
+          ("parse", "grep_todos", "git grep (subprocess)"),
+          ("parse", "load_index", "load task index"),
+          ("taskindex", "load_index", "load task index"),
+          ("__main__", "open_file_buffer", "editor round-trip"))
+
+# Every Taskwarrior client method twinput uses, by class
+CLIENT_METHODS = ("load_tasks", "get_task", "filter_tasks", "task_add",
+                  "task_update", "task_done", "task_delete", "_get_json")
+CLIENTS = (("taskw.warrior", "TaskWarriorShellout"),
+           ("taskw.warrior", "TaskWarriorDirect"),
+           ("taskdata", "DirectTaskWarrior"))
+
+# name -> [calls, seconds, longest]
+STATS = {}
+STATS_LOCK = Lock()
+
+
+def record(name, seconds):
+    # The interactive write queue calls Taskwarrior from its own thread
+    with STATS_LOCK:
+        stats = STATS.setdefault(name, [0, 0.0, 0.0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+
+def time_function(name, function):
+    @wraps(function)
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, perf_counter() - start)
+
+    return timed
+
+
+def time_generator(name, function):
+    # Generators are consumed bit by bit by the next stage, so only the
+    # time spent producing each item is counted
+    @wraps(function)
+    def timed(*args, **kwargs):
+        generator = function(*args, **kwargs)
+        seconds = 0.0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(generator)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += perf_counter() - start
+                yield item
+        finally:
+            record(name, seconds)
+
+    return timed
+
+
+def wrap(owner, attribute, name):
+    function = getattr(owner, attribute)
+    if isgeneratorfunction(function):
+        setattr(owner, attribute, time_generator(name, function))
+    else:
+        setattr(owner, attribute, time_function(name, function))
+
+
+def enable():
+    # Has to run before the modes import anything with `from x import y`
+    for module, function, name in STAGES:
+        module = import_module(module)
+        if hasattr(module, function):
+            wrap(module, function, name)
+
+    for module, class_name in CLIENTS:
+        client = getattr(import_module(module), class_name)
+        for method in CLIENT_METHODS:
+            if method in vars(client):
+                wrap(client, method, f"{class_name}.{method}")
+
+    # Each of these is a fork of the `task` binary
+    from taskw.warrior import TaskWarriorShellout
+    wrap(TaskWarriorShellout, "_execute", "task (subprocess)")
+
+
+def report(out=stderr):
+    rows = sorted(STATS.items(), key=lambda item: item[1][1], reverse=True)
+
+    out.write(f"\n{'stage':<36} {'calls':>7} {'total':>10} "
+              f"{'mean':>10} {'max':>10}\n")
+    for name, (calls, seconds, longest) in rows:
+        mean = seconds / calls
+        out.write(f"{name:<36} {calls:>7} {seconds * 1000:8.1f}ms "
+                  f"{mean * 1000:8.2f}ms {longest * 1000:8.1f}ms\n")
+
+
+def write_json(json_path, command):
+    # One line per stage, for whatever collects the metrics
+    timestamp = time()
+    with open(json_path, "a") as json_file:
+        for name, (calls, seconds, longest) in STATS.items():
+            json_file.write(dumps({"time": timestamp,
+                                   "command": command,
+                                   "stage": name,
+                                   "calls": calls,
+                                   "seconds": seconds,
+                                   "max": longest}) + "\n")
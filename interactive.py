@@ -13,39 +13,157 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from curses import (A_STANDOUT as EMPH, curs_set, echo, noecho)
+from curses import (A_STANDOUT as EMPH, KEY_BACKSPACE, KEY_END, KEY_ENTER,
+                    KEY_HOME, KEY_NPAGE, KEY_PPAGE, KEY_RESIZE, curs_set,
+                    doupdate, echo, noecho)
+from copy import deepcopy
+from heapq import nsmallest
+from queue import Empty, Queue
+from search import SearchIndex
+from taskdata import load_backend
 from taskw import TaskWarrior
+from taskw.exceptions import TaskwarriorError
+from threading import Lock, Thread
+from time import monotonic
 
 
-def get_tasks(tw, someday):
+# Seconds between reconciling the local task list with Taskwarrior
+RECONCILE_INTERVAL = 300
 
+# Milliseconds to wait for a key before checking on queued writes
+WRITE_POLL_INTERVAL = 250
+
+
+class WriteQueue:
+    # Runs Taskwarrior writes on a background thread, in the order they
+    # were made, so the key loop never waits on a `task` process. Failures
+    # are collected for the key loop to show.
+    def __init__(self, tw):
+        self.tw = tw
+        self.queue = Queue()
+        self.errors = Queue()
+        self.lock = Lock()
+        self.pending = 0
+
+        self.worker = Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def put(self, action, method, **kw):
+        with self.lock:
+            self.pending += 1
+        self.queue.put((action, method, kw))
+
+    def done(self, **kw):
+        self.put("Mark completed", "task_done", **kw)
+
+    def delete(self, **kw):
+        self.put("Delete", "task_delete", **kw)
+
+    def update(self, task):
+        # The key loop keeps editing its own copy of the task
+        self.put("Update", "task_update", task=deepcopy(task))
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            action, method, kw = item
+            try:
+                getattr(self.tw, method)(**kw)
+            except TaskwarriorError as err:
+                msg = err.stderr.decode("utf-8").split("\n")[-1]
+                self.errors.put(f"ERROR: {action} failed: {msg}")
+            except Exception as err:
+                # Anything else (no `task` binary, say) mustn't kill the
+                # worker, or the rest of the queue would never be written
+                # and close() would wait on it forever
+                self.errors.put(f"ERROR: {action} failed: {err}")
+            finally:
+                with self.lock:
+                    self.pending -= 1
+                self.queue.task_done()
+
+    def get_error(self):
+        try:
+            return self.errors.get_nowait()
+        except Empty:
+            return None
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.worker.join()
+
+
+def get_tasks(tw):
+    # Load the pending list once and split it into the normal and someday
+    # partitions; the browser keeps both up to date itself from then on.
     tasks_raw = tw.load_tasks("pending")["pending"]
 
-    if someday:
-        tasks = list(filter(lambda x:
-                            not x.get("imask", None)
-                            and "someday" in x["tags"],
-                            tasks_raw))
-    else:
-        tasks = list(filter(lambda x:
-                            not x.get("imask", None)
-                            and "someday" not in x["tags"],
-                            tasks_raw))
+    tasks = {True: [], False: []}
+    for task in tasks_raw:
+        if not task.get("imask", None):
+            tasks["someday" in task["tags"]].append(task)
 
     return tasks
 
 
-def refresh(tw, someday, pos):
-    tasks = get_tasks(tw, someday)
-    if not tasks:
+def get_indexes(tasks):
+    return {someday: SearchIndex(partition)
+            for someday, partition in tasks.items()}
+
+
+def refresh(tw, someday, pos, tasks):
+    # Reload from Taskwarrior, staying on the same task if it's still there
+    uuid = tasks[someday][pos]["uuid"] if pos >= 0 else None
+    tasks = get_tasks(tw)
+
+    pos = 0
+    for index, task in enumerate(tasks[someday]):
+        if task["uuid"] == uuid:
+            pos = index
+            break
+
+    if not tasks[someday]:
         pos = -1
-    elif pos > len(tasks):
-        pos = len(tasks) - 1
 
-    return tasks, pos
+    return tasks, pos, monotonic()
+
+
+def take_task(tasks, indexes, someday, view, pos):
+    # Take the task at pos out of its partition, its search index and,
+    # when a search is narrowing things down, the filtered view.
+    task = view[pos]
+    if view is not tasks[someday]:
+        tasks[someday].remove(task)
+    indexes[someday].remove(task)
+
+    return task, remove_task(view, pos)
+
+
+def unfilter(tasks, filtered, pos):
+    # Where the selected search result sits in the whole list
+    return tasks.index(filtered[pos]) if filtered else pos
 
 
-def draw_task(stdscr, task, flash, pos, task_count, show_help):
+def remove_task(tasks, pos):
+    del tasks[pos]
+
+    if not tasks:
+        return -1
+    elif pos >= len(tasks):
+        return len(tasks) - 1
+
+    return pos
+
+
+def draw_task(stdscr, task, flash, pos, task_count, show_help, writes=0):
     def get_context():
         if "home" in task["tags"]:
             return "Home"
@@ -58,8 +176,10 @@ def draw_task(stdscr, task, flash, pos, task_count, show_help):
         else:
             return "None"
 
-    stdscr.clear()
+    stdscr.erase()
     stdscr.addstr(0, 0, f'{pos + 1} of {task_count} tasks:')
+    if writes:
+        stdscr.addstr(0, 30, f'({writes} writes pending)')
 
     stdscr.addstr(2, 0, task["description"])
     stdscr.addstr(3, 2, f'ID:       {task["id"]}')
@@ -79,81 +199,303 @@ def draw_task(stdscr, task, flash, pos, task_count, show_help):
         stdscr.addstr(15, 2, "next:     j       mark completed: d")
         stdscr.addstr(16, 2, "goto:     g       delete task:    #")
         stdscr.addstr(17, 2, "quit:     q       edit effort:    e")
+        stdscr.addstr(18, 2, "reload:   r       list view:      l")
+        stdscr.addstr(19, 2, "search:   /       clear search:   Esc")
 
     if flash:
         stdscr.addstr(11, 0, flash)
 
 
+class ListView:
+    # Scrolling list of the tasks in view. Only the rows that fit on the
+    # screen are formatted, and only rows that differ from what's already
+    # on the screen are written.
+    def __init__(self, stdscr):
+        self.stdscr = stdscr
+        self.top = 0
+        self.shown = {}
+
+    def invalidate(self):
+        self.shown = {}
+
+    def page_size(self):
+        # Everything but the header and the flash line
+        return max(1, self.stdscr.getmaxyx()[0] - 2)
+
+    def draw_line(self, row, text, attr=0):
+        width = self.stdscr.getmaxyx()[1]
+        text = text[:width - 1]
+        if self.shown.get(row, None) == (text, attr):
+            return
+
+        self.stdscr.move(row, 0)
+        self.stdscr.clrtoeol()
+        self.stdscr.addstr(row, 0, text, attr)
+        self.shown[row] = (text, attr)
+
+    def draw(self, view, pos, flash, writes=0, query=None, count=None):
+        # count is the length of the whole list when view is only the
+        # start of it
+        height = self.page_size()
+
+        # Keep the selected task inside the window
+        if pos < self.top:
+            self.top = pos
+        elif pos >= self.top + height:
+            self.top = pos - height + 1
+
+        if count is None:
+            count = len(view)
+
+        header = f'{pos + 1} of {count} tasks'
+        header += f' matching "{query}":' if query else ':'
+        if writes:
+            header += f'  ({writes} writes pending)'
+        self.draw_line(0, header)
+
+        for row in range(height):
+            index = self.top + row
+            if index < len(view):
+                self.draw_line(row + 1, format_row(index, view[index]),
+                               EMPH if index == pos else 0)
+            else:
+                self.draw_line(row + 1, "")
+
+        self.draw_line(height + 1, flash or "")
+
+        self.stdscr.noutrefresh()
+        doupdate()
+
+
+def format_row(index, task):
+    project = task.get("project", None)
+    row = (f'{index + 1:>5} {task.get("id", "")!s:>4} '
+           f'{task.get("priority", None) or " "} {task["description"]}')
+    return row + f'  [{project}]' if project else row
+
+
+def search_tasks(stdscr, list_view, index, tasks):
+    # Incremental search: each key narrows the results for the query so
+    # far, and only the tasks that fit on the screen are put in order
+    # while typing. Enter keeps the filter, Escape drops it.
+    order = {str(task["uuid"]): number for number, task in enumerate(tasks)}
+    by_uuid = {str(task["uuid"]): task for task in tasks}
+
+    # Results for every prefix of the query, so backspace is free
+    query = ""
+    results = [None]
+
+    list_view.invalidate()
+    stdscr.timeout(-1)
+    while True:
+        if results[-1] is None:
+            shown = tasks[:list_view.page_size()]
+            count = len(tasks)
+        else:
+            shown = [by_uuid[uuid] for uuid in
+                     nsmallest(list_view.page_size(), results[-1],
+                               key=order.get)]
+            count = len(results[-1])
+
+        list_view.draw(shown, 0, "/" + query, count=count)
+
+        c = stdscr.getch()
+        if c in (KEY_ENTER, ord("\n")):
+            break
+        elif c == 27:
+            query = ""
+            break
+        elif c in (KEY_BACKSPACE, 127, 8):
+            if query:
+                query = query[:-1]
+                results.pop()
+        elif 32 <= c < 127:
+            query += chr(c)
+            results.append(index.search(query, results[-1]))
+
+    stdscr.timeout(WRITE_POLL_INTERVAL)
+    list_view.invalidate()
+
+    if not query.strip() or results[-1] is None:
+        return None, None
+
+    # Hand back the query even when nothing matched, to say so
+    return query, [by_uuid[uuid]
+                   for uuid in sorted(results[-1], key=order.get)]
+
+
 def jump(stdscr):
     stdscr.addstr(10, 0, "Goto:")
     stdscr.move(10, 6)
     echo()
+    stdscr.timeout(-1)
     resp = stdscr.getstr()
+    stdscr.timeout(WRITE_POLL_INTERVAL)
     noecho()
     return int(resp) - 1
 
 
-def update_effort(stdscr, tw, task):
+def update_effort(stdscr, writes, task):
     stdscr.addstr(10, 0, "Effort:")
     stdscr.move(10, 8)
     echo()
+    stdscr.timeout(-1)
     resp = stdscr.getstr()
+    stdscr.timeout(WRITE_POLL_INTERVAL)
     noecho()
     task["effort"] = int(resp)
-    tw.task_update(task)
+    writes.update(task)
 
 
 def interactive(stdscr, someday, flash=None):
     noecho()
     curs_set(False)
 
-    tw = TaskWarrior(marshal=True)
-    tasks = get_tasks(tw, someday)
+    tw = load_backend(TaskWarrior(marshal=True))
+    tasks = get_tasks(tw)
+    indexes = get_indexes(tasks)
+    loaded = monotonic()
 
-    if not tasks:
+    if not tasks[someday]:
         return
 
+    # Keys are applied to the local list straight away; the writes behind
+    # them drain in the background.
+    writes = WriteQueue(tw)
+    stdscr.timeout(WRITE_POLL_INTERVAL)
+
+    list_view = ListView(stdscr)
+    show_list = False
+    query = None
+    filtered = None
     show_help = False
     pos = 0
+    redraw = True
     while pos != -1:
-        draw_task(stdscr, tasks[pos], flash, pos, len(tasks), show_help)
-        flash = None
+        # Changes are applied to the local list as they're made, but pick
+        # up whatever happened outside of the browser every so often.
+        if monotonic() - loaded > RECONCILE_INTERVAL:
+            writes.flush()
+            pos = unfilter(tasks[someday], filtered, pos)
+            tasks, pos, loaded = refresh(tw, someday, pos, tasks)
+            indexes = get_indexes(tasks)
+            query, filtered = None, None
+            redraw = True
+            if pos == -1:
+                break
+
+        view = tasks[someday] if filtered is None else filtered
+        if redraw:
+            if show_list:
+                list_view.draw(view, pos, flash, writes.pending, query)
+            else:
+                draw_task(stdscr, view[pos], flash, pos, len(view),
+                          show_help, writes.pending)
+            shown_writes = writes.pending
+            flash = None
 
         c = stdscr.getch()
-        if c == ord("q"):
-            pos = -1
+        redraw = True
+
+        if c == -1:
+            # No key, just keep the writes counter and errors current
+            flash = writes.get_error()
+            redraw = flash is not None or writes.pending != shown_writes
+        elif c == ord("q"):
+            break
         elif c == ord("j"):
-            pos = (pos + 1) % len(tasks)
+            pos = (pos + 1) % len(view)
         elif c == ord("k"):
-            pos = (pos - 1) % len(tasks)
+            pos = (pos - 1) % len(view)
+        elif c == KEY_NPAGE:
+            pos = min(pos + list_view.page_size(), len(view) - 1)
+        elif c == KEY_PPAGE:
+            pos = max(pos - list_view.page_size(), 0)
+        elif c in (KEY_HOME, ord("<")):
+            pos = 0
+        elif c in (KEY_END, ord(">")):
+            pos = len(view) - 1
+        elif c == ord("l"):
+            show_list = not show_list
+            list_view.invalidate()
+        elif c in (KEY_ENTER, ord("\n")) and show_list:
+            show_list = False
+        elif c == KEY_RESIZE:
+            list_view.invalidate()
         elif c == ord("g"):
             try:
                 pos = jump(stdscr)
-                if pos > len(tasks):
-                    pos = len(tasks) - 1
+                if pos >= len(view):
+                    pos = len(view) - 1
                 elif pos < 0:
                     pos = 0
             except ValueError:
                 flash = "ERROR: Index must be an integer"
+            list_view.invalidate()
+        elif c == ord("/"):
+            query, filtered = search_tasks(stdscr, list_view,
+                                           indexes[someday], tasks[someday])
+            if filtered:
+                show_list = True
+                pos = 0
+            else:
+                flash = "No matching tasks" if query else None
+                query, filtered = None, None
+        elif c == 27 and filtered is not None:
+            # Drop the search, staying on the same task
+            pos = unfilter(tasks[someday], filtered, pos)
+            query, filtered = None, None
+            list_view.invalidate()
+        elif c == ord("r"):
+            writes.flush()
+            pos = unfilter(tasks[someday], filtered, pos)
+            tasks, pos, loaded = refresh(tw, someday, pos, tasks)
+            indexes = get_indexes(tasks)
+            query, filtered = None, None
+            flash = "Reloaded from Taskwarrior"
         elif c == ord("#"):
-            tw.task_delete(id=tasks[pos]["id"])
-            tasks, pos = refresh(tw, someday, pos)
+            writes.delete(uuid=view[pos]["uuid"])
+            _, pos = take_task(tasks, indexes, someday, view, pos)
         elif c == ord("d"):
-            tw.task_done(id=tasks[pos]["id"])
-            tasks, pos = refresh(tw, someday, pos)
+            writes.done(uuid=view[pos]["uuid"])
+            _, pos = take_task(tasks, indexes, someday, view, pos)
         elif c == ord("e"):
             try:
-                update_effort(stdscr, tw, tasks[pos])
+                update_effort(stdscr, writes, view[pos])
             except ValueError:
                 flash = "ERROR: Effort estimate must be an integer"
-            tasks, pos = refresh(tw, someday, pos)
+            list_view.invalidate()
         elif c == ord("s"):
+            task, pos = take_task(tasks, indexes, someday, view, pos)
             if someday:
-                tasks[pos]["tags"].remove("someday")
+                task["tags"].remove("someday")
             else:
-                tasks[pos]["tags"].append("someday")
+                task["tags"].append("someday")
 
-            tw.task_update(tasks[pos])
-            tasks, pos = refresh(tw, someday, pos)
+            writes.update(task)
+            tasks[not someday].append(task)
+            indexes[not someday].add(task)
         elif c == ord("?"):
             show_help = not show_help
+
+        # Emptying the search results goes back to the whole list
+        if pos == -1 and filtered is not None:
+            query, filtered = None, None
+            pos = 0 if tasks[someday] else -1
+            list_view.invalidate()
+
+    # Don't leave until everything queued has been written
+    if writes.pending:
+        stdscr.erase()
+        stdscr.addstr(0, 0, f'Writing {writes.pending} changes...')
+        stdscr.refresh()
+    writes.close()
+
+    # Hand back anything that failed too late to be shown
+    errors = []
+    error = writes.get_error()
+    while error:
+        errors.append(error)
+        error = writes.get_error()
+
+    return errors
@@ -13,308 +13,953 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import namedtuple
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from datetime import datetime, timezone
 from hashlib import md5
-from os import path, walk
-from re import findall, finditer, search, sub
+from json import dump, load
+from mmap import ACCESS_READ, mmap
+from os import (cpu_count, environ, makedirs, path, replace, scandir,
+                stat)
+from shutil import copymode
+from re import compile, sub
 from taskw.exceptions import TaskwarriorError
-from subprocess import run, PIPE
+from taskindex import load_index
+from tempfile import NamedTemporaryFile
+from subprocess import DEVNULL, PIPE, Popen, run
+from uuid import uuid4
+
+GIT_TODO_RE = compile(r"(.+?):(\d+):.+TODO:\s([\w\s\'\",:;\.]+)")
+GIT_SCAN_STATE = "twinput-scan.json"
+GIT_GREP_CHUNK_SIZE = 1000
+GIT_GREP_JOBS = 8
+
+# Trees with fewer org files than this aren't worth starting processes for
+ORG_POOL_MIN_FILES = 16
+ORG_POOL_CHUNKS = 4
+ORG_MANIFEST = "org-manifest.json"
+ORG_TODO_RE = compile(rb"^(\*+ +)TODO(?= )")
+ORG_TODO_BYTES_RE = compile(rb"(?m)^\*+ +TODO ")
+ORG_HEADLINE_RE = compile(r"\*+ +TODO +(.*)")
+ORG_PRIORITY_RE = compile(r"\[#([ABCDEF])\]")
+ORG_TAGS_RE = compile(r":(\S+):")
+ORG_DEADLINE_RE = compile(r"DEADLINE: *<(\d{4}-\d{2}-\d{2}) "
+                          r"\w{3} ?(\d{2}:\d{2})?>")
+ORG_SCHEDULED_RE = compile(r"SCHEDULED: *<(\d{4}-\d{2}-\d{2}) "
+                           r"\w{3} ?(\d{2}:\d{2})?>")
+ORG_PROJECT_RE = compile(r":project:\s*(.*)")
+ORG_PROPERTY_RE = compile(r":(.+?):\s*(.*)")
+
+# Org priorities to Taskwarrior priorities; [#D] (and no priority) is N
+ORG_PRIORITIES = {"A": "U", "B": "H", "C": "M", "E": "L", "F": "T"}
+
+# parse_org_mode states
+ORG_NONE = 0
+ORG_ENTRY = 1
+ORG_DRAWER = 2
+
+# Number of tasks handed to a single `task import` call
+IMPORT_CHUNK_SIZE = 500
+
+IMPORT_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+DATE_FORMATS = (IMPORT_DATE_FORMAT,
+                "%Y-%m-%d",
+                "%Y-%m-%dT%H:%M",
+                "%Y-%m-%dT%H:%M:%S")
+DATE_FIELDS = ("due", "scheduled", "wait", "until", "start", "end")
+
+# Todo line grammar: ([P]) [DESCRIPTION] @[TAG] +[PROJECT] [ATTRIBUTE]:[VALUE]
+# Tokens only start at the beginning of a word, and attribute values can't
+# start with "//", so e-mail addresses and URLs stay in the description.
+PRIORITY_RE = compile(r"\((\w+)\)")
+TOKEN_RE = compile(r"(?<!\S)(?:\+(?P<project>\S+)"
+                   r"|@(?P<context>\S+)"
+                   r"|(?P<key>\w+):(?!//)(?P<value>\S+))")
+
+# Scan states and manifests already read, by path
+STATE_CACHE = {}
+
+ParsedLine = namedtuple("ParsedLine", ["description", "priority", "project",
+                                       "tags", "attributes"])
+
+
+def get_state_signature(state_path):
+    info = stat(state_path)
+    return info.st_mtime_ns, info.st_size
+
+
+def load_state(state_path):
+    # A long-running process (the twinput server) keeps any state it has
+    # read for as long as the file doesn't change.
+    try:
+        signature = get_state_signature(state_path)
+        cached = STATE_CACHE.get(state_path, None)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        with open(state_path, "r") as state_file:
+            state = load(state_file)
+    except (OSError, ValueError):
+        return {}
+
+    STATE_CACHE[state_path] = (signature, state)
+    return state
+
+
+def save_state(state_path, state):
+    # Scan state is only an optimization, losing it just means the next
+    # run does a full scan.
+    try:
+        makedirs(path.dirname(state_path), exist_ok=True)
+        with open(state_path, "w") as state_file:
+            dump(state, state_file)
+        STATE_CACHE[state_path] = (get_state_signature(state_path), state)
+    except OSError:
+        STATE_CACHE.pop(state_path, None)
+
+
+def get_cache_dir():
+    cache_home = environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache"))
+    return path.join(cache_home, "twinput")
+
+
+def git(directory, *args):
+    return run(["git"] + list(args), cwd=directory, stdout=PIPE,
+               stderr=DEVNULL, universal_newlines=True)
+
+
+def load_git_scan_state(directory):
+    # Scan state lives in the repository's git dir, keyed by the directory
+    # inside the work tree the scan was run from.
+    git_dir = git(directory, "rev-parse", "--absolute-git-dir").stdout.strip()
+    prefix = git(directory, "rev-parse", "--show-prefix").stdout.strip()
+    if not git_dir:
+        return None, prefix, {}
+
+    state_path = path.join(git_dir, GIT_SCAN_STATE)
+    return state_path, prefix, load_state(state_path)
+
+
+def get_changed_files(directory, state):
+    # Everything that differs between the last scanned commit and the work
+    # tree, plus whatever was dirty back then (it might have been reverted
+    # since). None means the whole tree has to be scanned.
+    if not state.get("head", None):
+        return None
+
+    # A rename is the old path deleted and the new one added, so the old
+    # path's TODOs are looked at (and found gone) too
+    diff = git(directory, "diff", "--relative", "--name-only", "--no-renames",
+               state["head"])
+    if diff.returncode != 0:
+        return None
+
+    return set(diff.stdout.splitlines()) | set(state["dirty"])
+
+
+def grep_todos(directory, files=None):
+    if files is None:
+        pathspecs = [[]]
+    else:
+        files = sorted(files)
+        pathspecs = [["--"] + files[start:start + GIT_GREP_CHUNK_SIZE]
+                     for start in range(0, len(files), GIT_GREP_CHUNK_SIZE)]
+
+    # Stream the matches straight into the parser instead of waiting for
+    # git grep to finish and holding all of its output.
+    for pathspec in pathspecs:
+        with Popen(["git", "grep", "-n", "TODO:"] + pathspec, cwd=directory,
+                   stdout=PIPE, stderr=DEVNULL,
+                   universal_newlines=True) as grep:
+            for line in grep.stdout:
+                regex = GIT_TODO_RE.search(line.rstrip("\n"))
+                if regex:
+                    yield regex.group(1), int(regex.group(2)), regex.group(3)
 
 
-def git_grep_todos(directory):
+def format_git_todo(template, todo_file, todo_line, todo):
+    task = sub(r"\${TODO}", todo, template)
+    return task + f" twi_file:{todo_file} twi_line:{todo_line}"
+
+
+def save_git_scans(scans):
+    # Called once what was harvested has gone into Taskwarrior, so a dry
+    # run or a failed import harvests the same TODOs next time
+    for state_path, prefix, state in scans:
+        states = dict(load_state(state_path))
+        states[prefix] = state
+        save_state(state_path, states)
+
+
+def git_grep_todos(directory, full=False, vanished=None, dry_run=False,
+                   scans=None):
+    # The new scan state is added to scans, for save_git_scans() to write
+    # once the import has succeeded
     with open(directory + "/.twparse", "r") as template_file:
         template = template_file.readline().strip()
 
-    result = run(["git", "grep", "-n", "TODO:"], cwd=directory,
-                 stdout=PIPE).stdout.decode()
-    lines = result.split("\n")
+    # Only files that changed since the last scan are grepped again, unless
+    # a full scan is asked for or the template itself changed.
+    state_path, prefix, states = load_git_scan_state(directory)
+    state = states.get(prefix, {})
+    if full or state.get("template", None) != template:
+        state = {}
+
+    changed = get_changed_files(directory, state)
+    todos = {} if changed is None else dict(state["todos"])
+    found = {}
+
+    for todo_file, todo_line, todo in grep_todos(directory, changed):
+        found.setdefault(todo_file, []).append([todo_line, todo])
+        yield format_git_todo(template, todo_file, todo_line, todo)
+
+    # Report the TODOs that are gone from the files we looked at
+    scanned = set(state.get("todos", {})) if changed is None else changed
+    for todo_file in scanned:
+        current = set(todo for (_, todo) in found.get(todo_file, []))
+        for todo_line, todo in state.get("todos", {}).get(todo_file, []):
+            if todo not in current and vanished is not None:
+                vanished.append(format_git_todo(template, todo_file,
+                                                todo_line, todo))
+        todos.pop(todo_file, None)
+
+    todos.update(found)
+
+    if not state_path or dry_run or scans is None:
+        return
+
+    head = git(directory, "rev-parse", "--verify", "HEAD").stdout.strip()
+    dirty = git(directory, "diff", "--relative", "--name-only", "--no-renames",
+                "HEAD")
+    scans.append((state_path, prefix, {"template": template,
+                                       "head": head or None,
+                                       "dirty": dirty.stdout.splitlines(),
+                                       "todos": todos}))
+
+
+def find_repos(root):
+    # Repositories opt in to harvesting by having a .twparse template.
+    # Don't descend any further once one is found.
+    try:
+        entries = sorted(scandir(root), key=lambda entry: entry.name)
+    except OSError:
+        return
+
+    names = set(entry.name for entry in entries)
+    if ".twparse" in names and ".git" in names:
+        yield root
+        return
+
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False) and entry.name != ".git":
+            yield from find_repos(entry.path)
+
+
+def scan_repo(directory, full=False, dry_run=False, scans=None):
+    repo = sub(r"\s", "_", path.basename(path.abspath(directory)))
+    gone = []
+
+    lines = [line + f" twi_repo:{repo}"
+             for line in git_grep_todos(directory, full, gone, dry_run,
+                                        scans)]
+    return lines, [line + f" twi_repo:{repo}" for line in gone]
+
+
+def git_grep_repos(directories, jobs=GIT_GREP_JOBS, full=False,
+                   vanished=None, dry_run=False, scans=None):
+    # The work for each repository is a handful of git processes, so a
+    # small thread pool is enough to keep them all running side by side.
+    # Each repository's lines are passed on as soon as its scan finishes.
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(scan_repo, directory, full, dry_run, scans)
+                   for directory in directories]
+
+        for future in as_completed(futures):
+            try:
+                lines, gone = future.result()
+            except OSError:
+                # No .twparse, or not a repository we can read
+                continue
 
-    text = ""
-    for line in lines:
-        try:
-            regex = search(r"(.+?):(\d+):.+TODO:\s([\w\s\'\",:;\.]+)", line)
-            task = sub(r"\${TODO}", regex.group(3), template)
-            text += (task
-                     + f" twi_file:{regex.group(1)}"
-                     + f" twi_line:{regex.group(2)}\n")
-        except AttributeError:
-            pass
+            yield from lines
+            if vanished is not None:
+                vanished.extend(gone)
 
-    return text
 
+def find_org_files(directory):
+    try:
+        entries = list(scandir(directory))
+    except OSError:
+        return
 
-def read_pim(pim_dir):
-    org_files = []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from find_org_files(entry.path)
+        elif not entry.name.startswith(".") and entry.name.endswith("org"):
+            yield entry.path
 
-    # Find the org files
-    for root, dirs, files in walk(pim_dir):
-        for file in files:
-            if not file.startswith(".") and file.endswith("org"):
-                org_files.append(path.join(root, file))
 
-    # Parse all found org files
-    org_tasks = ""
-    for org_file in org_files:
-        org_tasks += parse_org_mode(org_file)
+def scan_org_file(org_file_path):
+    # Look for a TODO headline in the raw bytes and hash them, through a
+    # mapping of the file rather than reading, decoding or splitting it.
+    with open(org_file_path, "rb") as org_file:
+        try:
+            with mmap(org_file.fileno(), 0, access=ACCESS_READ) as content:
+                has_todo = (content.find(b"TODO") != -1
+                            and ORG_TODO_BYTES_RE.search(content) is not None)
+                return has_todo, md5(content).hexdigest()
+        except ValueError:
+            # Empty files can't be mapped
+            return False, md5(b"").hexdigest()
+
+
+def get_org_manifest_entry(org_file_path):
+    info = stat(org_file_path)
+    return [info.st_mtime_ns, info.st_size, scan_org_file(org_file_path)[1]]
+
+
+def read_org_file(org_file_path):
+    # Tasks come back with the line numbers of their headlines
+    headlines = []
+    tasks = list(parse_org_mode(org_file_path, headlines))
+    return tasks, headlines
+
+
+def read_pim(pim_dir, marks=None):
+    # Files that haven't changed since the last import are skipped without
+    # being opened. The manifest of what was seen is kept per PIM directory.
+    #
+    # Nothing is written here. With a marks list, the headlines to mark
+    # TASKED and the manifest are added to it, for mark_org_todos() to
+    # write once the import is done; without one (a dry run) the TODOs
+    # are left to be seen again.
+    manifest_path = path.join(get_cache_dir(), ORG_MANIFEST)
+    manifests = load_state(manifest_path)
+    manifest = manifests.get(path.abspath(pim_dir), {})
+    seen = {}
+
+    # Sorted, so tasks always come out in the same order no matter how
+    # the parsing is spread over processes.
+    org_files = []
+    for org_file in sorted(find_org_files(pim_dir)):
+        entry = manifest.get(org_file, None)
+        info = stat(org_file)
 
-    return org_tasks
+        if entry and entry[:2] == [info.st_mtime_ns, info.st_size]:
+            seen[org_file] = entry
+            continue
 
+        # Only parsed if there's something to import, and it isn't just
+        # touched with the contents we saw last time
+        has_todo, content_hash = scan_org_file(org_file)
+        seen[org_file] = [info.st_mtime_ns, info.st_size, content_hash]
+        if has_todo and not (entry and entry[2] == content_hash):
+            org_files.append(org_file)
+
+    imported = []
+    if len(org_files) < ORG_POOL_MIN_FILES:
+        results = map(read_org_file, org_files)
+        for org_file, (tasks, headlines) in zip(org_files, results):
+            imported.append((org_file, seen[org_file][2],
+                             list(zip(headlines, tasks))))
+            yield from tasks
+    else:
+        # Each file is parsed by exactly one worker, and the results are
+        # handed back in file order.
+        workers = cpu_count() or 1
+        chunksize = max(1, len(org_files) // (workers * ORG_POOL_CHUNKS))
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(read_org_file, org_files,
+                               chunksize=chunksize)
+            for org_file, (tasks, headlines) in zip(org_files, results):
+                imported.append((org_file, seen[org_file][2],
+                                 list(zip(headlines, tasks))))
+                yield from tasks
+
+    if marks is not None:
+        marks.append((manifest_path, path.abspath(pim_dir), seen, imported))
+
+
+def mark_org_todos(marks, failed_lines):
+    # Mark the headlines that were imported TASKED, and record what was
+    # seen. A file is left out of the manifest, to be parsed again next
+    # time, if any of its headlines failed or if it changed since it was
+    # read (its line numbers can't be trusted then).
+    failed = set(line for (line, _) in failed_lines)
+    for manifest_path, pim_key, seen, imported in marks:
+        for org_file, content_hash, headlines in imported:
+            if not headlines:
+                continue
 
-def parse_org_mode(org_file_path):
-    # Read the org file into memory
-    with open(org_file_path, "r") as org_file:
-        org_text = org_file.read()
+            numbers = [number for (number, todo) in headlines
+                       if todo not in failed]
+            try:
+                if get_org_manifest_entry(org_file)[2] != content_hash:
+                    seen.pop(org_file, None)
+                    continue
+
+                if numbers:
+                    rewrite_org_headlines(org_file, numbers)
+                seen[org_file] = get_org_manifest_entry(org_file)
+            except OSError:
+                seen.pop(org_file, None)
+                continue
 
-    prop = False
-    tasks = ""
+            if len(numbers) < len(headlines):
+                seen.pop(org_file, None)
+
+        manifests = dict(load_state(manifest_path))
+        manifests[pim_key] = seen
+        save_state(manifest_path, manifests)
+
+
+def rewrite_org_headlines(org_file_path, headlines):
+    # Mark only the headlines that were imported, and write the file
+    # through a temporary file so it's never left half written. Bytes in
+    # and out, so nothing but those keywords (not the line endings, not
+    # the encoding) changes.
+    headlines = set(headlines)
+
+    directory, name = path.split(org_file_path)
+    with open(org_file_path, "rb") as org_file, \
+            NamedTemporaryFile("wb", dir=directory, prefix=f".{name}.",
+                               delete=False) as new_file:
+        for number, line in enumerate(org_file):
+            if number in headlines:
+                line = ORG_TODO_RE.sub(rb"\1TASKED", line, count=1)
+            new_file.write(line)
+
+    copymode(org_file_path, new_file.name)
+    replace(new_file.name, org_file_path)
+
+
+def get_org_headline_task(headline):
+    todo = headline.strip()
+
+    priority = ORG_PRIORITY_RE.search(todo)
+    if priority:
+        todo = ORG_PRIORITY_RE.sub("", todo).strip()
+        todo = f"({ORG_PRIORITIES.get(priority.group(1), 'N')}) " + todo
+    else:
+        todo = "(N) " + todo
+
+    tags = ORG_TAGS_RE.search(todo)
+    if tags:
+        todo = ORG_TAGS_RE.sub("", todo).strip()
+        for tag in tags.group(1).split(":"):
+            todo += " @" + tag
+    else:
+        todo += " @home"
+
+    return todo
+
+
+def get_org_planning(line):
+    # Returns the attributes found on a planning or property line, or None
+    # if the line isn't one.
+    attributes = ""
+    match = False
+
+    if "DEADLINE:" in line:
+        deadline = ORG_DEADLINE_RE.search(line)
+        if deadline:
+            match = True
+            attributes += " due:" + deadline.group(1)
+            if deadline.group(2):
+                attributes += "T" + deadline.group(2)
+
+    if "SCHEDULED:" in line:
+        scheduled = ORG_SCHEDULED_RE.search(line)
+        if scheduled:
+            match = True
+            attributes += " scheduled:" + scheduled.group(1)
+            if scheduled.group(2):
+                attributes += "T" + scheduled.group(2)
+
+    if ":project:" in line:
+        project = ORG_PROJECT_RE.search(line)
+        match = True
+        attributes += " +" + project.group(1)
+
+    # Look for any properties tags
+    if not match:
+        org_prop = ORG_PROPERTY_RE.search(line)
+        if not org_prop:
+            return None
+        attributes += " " + org_prop.group(1).lower() + ":" + org_prop.group(2)
+
+    return attributes
+
+
+def parse_org_mode(org_file_path, headlines=None):
+    # Each line is classified once, based on where we are in the entry:
+    #
+    #   ORG_NONE:    outside of a TODO entry, only headlines matter.
+    #   ORG_ENTRY:   after a TODO headline, collecting planning lines.
+    #   ORG_DRAWER:  inside the entry's PROPERTIES drawer.
+    #
+    # Anything else (body text) ends the entry. Every line that can carry
+    # entry data has a colon in it, which makes for a cheap prefilter.
+    #
+    # Every TODO headline yields one task, and its line number is added
+    # to headlines, in the same order.
+    state = ORG_NONE
     todo = ""
-    for line in org_text.split("\n"):
+    if headlines is None:
+        headlines = []
+
+    # Lines are numbered like rewrite_org_headlines() reads them, ended by
+    # \n alone
+    with open(org_file_path, "r", newline="\n") as org_file:
+        for number, line in enumerate(org_file):
+            line = line.rstrip("\r\n")
+
+            if line.startswith("*"):
+                headline = ORG_HEADLINE_RE.match(line)
+                if headline:
+                    if state != ORG_NONE:
+                        yield todo
+
+                    headlines.append(number)
+                    todo = get_org_headline_task(headline.group(1))
+                    state = ORG_ENTRY
+                    continue
+
+            if state == ORG_NONE:
+                continue
+
+            if ":" not in line:
+                if line.strip() != "":
+                    yield todo
+                    state = ORG_NONE
+                continue
+
+            if ":PROPERTIES:" in line:
+                state = ORG_DRAWER
+                continue
+
+            if ":END:" in line:
+                yield todo
+                state = ORG_NONE
+                continue
+
+            attributes = get_org_planning(line)
+            if attributes is not None:
+                todo += attributes
+            elif line.strip() != "":
+                yield todo
+                state = ORG_NONE
+
+    if state != ORG_NONE:
+        yield todo
+
+
+def get_projects_from_tw(pending):
+    projects = {"B": {}, "R": {}, "N": {}, "I": {}, "W": {}}
+
+    for task in pending:
         try:
-            # Check for a new to do entry
-            todo_check = search(r"\*+ +TODO +(.*)", line)
+            project = task["project"]
+        except KeyError:
+            continue
 
-            # If we have an existing to do entry, commit it
-            if todo_check:
+        if project not in projects[task["delay"]]:
+            projects[task["delay"]][project] = []
 
-                if todo != "":
-                    tasks += todo + "\n"
+        projects[task["delay"]][project].append(task)
 
-                todo = todo_check.group(1).strip()
+    return projects
 
-                try:
-                    priority = search(r"(\[#[ABCDEF]\])", todo).group(1)
-                    todo = sub(r"\[#[ABCDEF]\]", "", todo).strip()
-
-                    if priority == "[#A]":
-                        todo = "(U) " + todo
-                    elif priority == "[#B]":
-                        todo = "(H) " + todo
-                    elif priority == "[#C]":
-                        todo = "(M) " + todo
-                    elif priority == "[#E]":
-                        todo = "(L) " + todo
-                    elif priority == "[#F]":
-                        todo = "(T) " + todo
-                    else:
-                        todo = "(N) " + todo
-                except AttributeError:
-                    todo = "(N) " + todo
 
-                try:
-                    tags = search(r":(\S+):", todo).group(1)
-                    tags = tags.split(":")
-                    todo = sub(r":\S+:", "", todo)
-                    todo = todo.strip()
+def get_error_message(err):
+    return err.stderr.decode("utf-8").split("\n")[-1]
 
-                    for tag in tags:
-                        todo += " @" + tag
-                except AttributeError:
-                    todo += " @home"
 
-        except AttributeError:
-            pass
+def parse_line(line):
+    # Scan the line once, left to right. Everything that isn't the
+    # priority or a project, context or attribute token is kept as the
+    # task description.
+    priority = None
+    project = None
+    tags = []
+    attributes = {}
+    description = []
 
-        if not todo_check and todo != "":
-            match = False
+    pos = 0
+    match = PRIORITY_RE.match(line)
+    if match:
+        priority = match.group(1)
+        pos = match.end()
 
-            # Check for the start of the PROPERTIES drawer
-            tag = search(r"\s*:PROPERTIES:\s*", line)
-            if tag:
-                continue
+    for match in TOKEN_RE.finditer(line, pos):
+        description.append(line[pos:match.start()])
+        pos = match.end()
 
-            # Check for the end of the PROPERTIES drawer
-            tag = search(r"\s*:END:\s*", line)
-            if tag:
-                tasks += todo + "\n"
-                todo = ""
-                continue
+        if match.lastgroup == "project":
+            if project is None:
+                project = match.group("project")
+        elif match.lastgroup == "context":
+            tags.append(match.group("context"))
+        else:
+            attributes[match.group("key")] = match.group("value")
 
-            # Look for a deadline
-            try:
-                deadline = search(r".*DEADLINE: *<(\d{4}-\d{2}-\d{2}) "
-                                  r"\w{3} ?(\d{2}:\d{2})?>", line)
-                due_date = deadline.group(1)
-                due_time = deadline.group(2)
-                match = True
-
-                if due_date and due_time:
-                    todo += " due:" + due_date + "T" + due_time
-                elif due_date:
-                    todo += " due:" + due_date
-            except AttributeError:
-                pass
+    description.append(line[pos:])
 
-            # Look for a scheduled date
-            try:
-                scheduled = search(r".*SCHEDULED: *<(\d{4}-\d{2}-\d{2}) "
-                                   r"\w{3} ?(\d{2}:\d{2})?>", line)
-                sched_date = scheduled.group(1)
-                sched_time = scheduled.group(2)
-                match = True
-
-                if sched_date and sched_time:
-                    todo += " scheduled:" + sched_date + "T" + sched_time
-                elif sched_date:
-                    todo += " scheduled:" + sched_date
-            except AttributeError:
-                pass
+    return ParsedLine("".join(description).strip(), priority, project, tags,
+                      attributes)
+
+
+def get_task_data(parsed):
+    # Build a dictionary that will become the task
+    task_data = {}
+
+    if parsed.priority is not None:
+        task_data["priority"] = parsed.priority
+    if parsed.project is not None:
+        task_data["project"] = parsed.project
+
+    task_data["tags"] = list(parsed.tags)
+    task_data.update(parsed.attributes)
 
+    return task_data
+
+
+def get_twi_hash(description):
+    # Hash the input description case insensitively.
+    return md5(description.upper().encode("utf-8")).hexdigest()
+
+
+def get_line_hash(line):
+    # Unlike the description hash, any edit to the line counts
+    return md5(line.strip().encode("utf-8")).hexdigest()
+
+
+def to_import_value(taskw, key, value):
+    # Convert a parsed attribute into the form `task import` expects.
+    # Anything we can't convert without Taskwarrior's help (date synonyms,
+    # durations, unknown attributes...) raises a ValueError, and the line
+    # is committed through the regular add/modify path instead.
+    if key in ("description", "project", "tags"):
+        return value
+
+    uda = taskw.config.get("uda", {}).get(key, None)
+    if key in DATE_FIELDS:
+        uda_type = "date"
+    elif key == "priority" and not uda:
+        return value
+    elif isinstance(uda, dict):
+        uda_type = uda.get("type", "string")
+    else:
+        raise ValueError(f"{key} is not a known attribute")
+
+    values = uda.get("values", None) if isinstance(uda, dict) else None
+    if values is not None and value not in values.split(","):
+        raise ValueError(f"{value} is not an allowed {key}")
+
+    if uda_type == "string":
+        return value
+    elif uda_type == "numeric":
+        number = float(value)
+        return int(number) if number.is_integer() else number
+    elif uda_type == "date":
+        for date_format in DATE_FORMATS:
             try:
-                org_prop = search(r"\s*:project:\s*(.*)", line)
+                date = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
 
-                proj_name = org_prop.group(1)
-                match = True
+            if date_format != IMPORT_DATE_FORMAT:
+                date = date.astimezone(timezone.utc)
+            return date.strftime(IMPORT_DATE_FORMAT)
 
-                todo += " +" + proj_name
-            except AttributeError:
-                pass
+    raise ValueError(f"{value} can not be imported as {key}")
+
+
+def build_import_task(taskw, task, description, twi_hash, task_data):
+    now = datetime.now(timezone.utc).strftime(IMPORT_DATE_FORMAT)
+
+    if task:
+        record = dict(task)
+        record["modified"] = now
+    else:
+        record = {"uuid": str(uuid4()),
+                  "status": "pending",
+                  "entry": now,
+                  "twi_hash": twi_hash}
+
+    for key, value in task_data.items():
+        if key == "id":
+            continue
+        record[key] = to_import_value(taskw, key, value)
+
+    record["description"] = description
+
+    # Computed by Taskwarrior, never imported
+    record.pop("id", None)
+    record.pop("urgency", None)
+    if not record.get("tags", None):
+        record.pop("tags", None)
+
+    return record
+
+
+def task_differs(task, record):
+    # Fields Taskwarrior maintains itself don't count as changes
+    for key in (set(task) | set(record)) - {"id", "urgency", "modified"}:
+        old = task.get(key, None)
+        new = record.get(key, None)
+
+        if key == "tags":
+            old = set(old or [])
+            new = set(new or [])
+
+        if old != new:
+            return True
 
-            # Look for any properties tags
-            if not match:
+    return False
+
+
+def line_differs(task, description, task_data):
+    # Values on this path haven't been normalized, so this only catches
+    # lines that repeat exactly what Taskwarrior already has.
+    if task["description"] != description:
+        return True
+
+    for key, value in task_data.items():
+        if key == "id":
+            continue
+        elif key == "tags":
+            if set(task.get("tags", None) or []) != set(value):
+                return True
+        elif str(task.get(key, "")) != value:
+            return True
+
+    return False
+
+
+def find_task(index, twi_hash, task_data):
+    # There are two ways we know we're updating a task that was
+    # previously entered:
+    #   1. if a task id is given immediately before the
+    #      priority in brackets, or
+    #   2. if we can find a task with the same hash as this task's
+    #      description.
+    #
+    # So, first we try to find the task by id, then by hash.
+    task_id = task_data.get("id", None)
+    if task_id:
+        return index.get(id=task_id)
+    else:
+        return index.get(twi_hash=twi_hash)
+
+
+def import_tasks(taskw, tasks):
+    with NamedTemporaryFile("w", suffix=".json") as tf:
+        dump(tasks, tf)
+        tf.flush()
+        taskw._execute("import", tf.name)
+
+
+def commit_batch(taskw, batch, failed_lines):
+    for start in range(0, len(batch), IMPORT_CHUNK_SIZE):
+        chunk = batch[start:start + IMPORT_CHUNK_SIZE]
+
+        try:
+            import_tasks(taskw, [task for (_, task) in chunk])
+        except TaskwarriorError:
+            # A failed import tells us nothing about which task caused
+            # the failure, so retry the chunk one task at a time.
+            for line, task in chunk:
                 try:
-                    org_prop = search(r"\s*:(.+?):\s*(.*)", line)
+                    import_tasks(taskw, [task])
+                except TaskwarriorError as err:
+                    failed_lines.append((line, get_error_message(err)))
+
+
+def commit_line(taskw, index, task, description, twi_hash, task_data):
+    # If we didn't find a task, then we create a new one.
+    if not task:
+        try:
+            task = taskw.task_add(description, twi_hash=twi_hash)
+            index.add(task)
 
-                    prop_tag = org_prop.group(1).lower()
-                    prop_val = org_prop.group(2)
-                    match = True
+        except TaskwarriorError as err:
+            return get_error_message(err)
 
-                    todo += " " + prop_tag + ":" + prop_val
-                except AttributeError:
-                    pass
+    task = dict(task)
 
-            if not match and line.strip() != "":
-                tasks += todo + "\n"
-                todo = ""
+    # Attempt to update tasks
+    try:
+        for key, value in task_data.items():
+            task[key] = value
 
-    if todo != "":
-        tasks += todo + "\n"
+        taskw.task_update(task)
 
-    org_text = sub(r"TODO", "TASKED", org_text)
-    with open(org_file_path, "w") as org_file:
-        org_file.write(org_text)
+        # TODO: Figure out why descriptions get dropped
+        # This is here because task descriptions get dropped sometimes,
+        # and I don't really know why.
+        (_, task) = taskw.get_task(uuid=task["uuid"])
+        if task["description"] != description:
+            task["description"] = description
+            taskw.task_update(task)
+        index.add(task)
+    except TaskwarriorError as err:
+        return get_error_message(err)
 
-    return tasks
+    return None
 
 
-def get_projects_from_tw(pending):
-    projects = {"B": {}, "R": {}, "N": {}, "I": {}, "W": {}}
+def complete_todos(taskw, lines, index=None):
+    if index is None:
+        index = load_index(taskw)
+
+    failed_lines = []
+    for line in lines:
+        parsed = parse_line(line)
+        task = index.get(twi_hash=get_twi_hash(parsed.description))
+        if not task:
+            continue
 
-    for task in pending:
         try:
-            project = task["project"]
-        except KeyError:
+            taskw.task_done(uuid=task["uuid"])
+        except TaskwarriorError as err:
+            failed_lines.append((line, get_error_message(err)))
             continue
 
-        if project not in projects[task["delay"]]:
-            projects[task["delay"]][project] = []
+        # Completed tasks aren't pending any more, so a TODO that comes
+        # back later gets a new task rather than this one
+        index.remove(task)
 
-        projects[task["delay"]][project].append(task)
+    return failed_lines
 
-    return projects
 
+def parse_todos(taskw, lines, batch=True, index=None, dry_run=False,
+                report=None, applied=None):
+    # Accept a whole buffer as well as any iterable of lines (a file object,
+    # sys.stdin, one of the generators above...). Lines are committed in
+    # chunks as they're read, so the input is never held in memory.
+    #
+    # `applied` is a set of line hashes kept across the editor's retry
+    # rounds. Lines already applied in an earlier round are skipped (and
+    # reported as "applied"), and the ones applied by this round are added.
+    if isinstance(lines, str):
+        lines = lines.split("\n")
 
-def parse_todos(taskw, text):
-    lines = text.split("\n")
     failed_lines = []
+    attempted = set()
+
+    # Resolve every line against one export of the pending tasks rather
+    # than a filtered export per line.
+    if index is None:
+        index = load_index(taskw)
+
+    # Tasks waiting to be written with a single `task import`. Staged
+    # records go into the index straight away, so repeated lines in one
+    # input update each other rather than creating duplicates.
+    pending = []
+    staged = {}
 
     for line in lines:
+        line = line.rstrip("\n")
+
         try:
             if line[0] == "#":
                 continue
         except IndexError:
             continue
 
-        # Metadata will be trimmed from the line.
-        # The leftovers will be interpreted as the task description.
-        description = line
+        if applied is not None:
+            line_hash = get_line_hash(line)
+            if line_hash in applied:
+                if report:
+                    report("applied", line)
+                continue
+            attempted.add(line_hash)
 
-        # Build a dictionary that will become the task
-        task_data = {}
+        parsed = parse_line(line)
+        description = parsed.description
+        task_data = get_task_data(parsed)
 
-        # Get the task priority
-        try:
-            task_data["priority"] = search(r"^\((\w+)\)", line).group(1)
-            description = sub(r"^\(\w+\)", "", description)
-        except AttributeError:
-            pass
+        if description == "":
+            msg = "No description found."
+            failed_lines.append((line, msg))
+            continue
 
-        # Get the task project
-        try:
-            task_data["project"] = search(r"\+(\S+)", line).group(1)
-            description = sub(r"\+\S+", "", description)
-        except AttributeError:
-            pass
-
-        # Get the task context(s)
-        task_data["tags"] = []
-        for match in finditer(r"@(\S+)", line):
+        twi_hash = get_twi_hash(description)
+        task = find_task(index, twi_hash, task_data)
+
+        record = None
+        if batch:
             try:
-                task_data["tags"].append(match.group(1))
-            except AttributeError:
+                record = build_import_task(taskw, task, description,
+                                           twi_hash, task_data)
+            except ValueError:
                 pass
 
-        description = sub(r"@\S+", "", description)
+        # Only write tasks that are new or actually differ from what
+        # Taskwarrior already has.
+        if not task:
+            action = "create"
+        elif record and task_differs(task, record):
+            action = "update"
+        elif not record and line_differs(task, description, task_data):
+            action = "update"
+        else:
+            action = "unchanged"
 
-        # Get any other tags
-        for match in finditer(r"(\w+):(\S+)", line):
-            try:
-                task_data[match.group(1)] = match.group(2)
-            except (AttributeError, IndexError):
-                pass
+        if report:
+            report(action, line)
 
-        description = sub(r"\w+:\S+", "", description)
-        description = description.strip()
+        if action == "unchanged":
+            continue
 
-        if description == "":
-            msg = "No description found."
-            failed_lines.append((line, msg))
+        if dry_run:
+            # Let repeated lines in the input see this one's task
+            if record:
+                index.add(record)
             continue
 
-        # Hash the input description case insensitively.
-        twi_hash = md5(description.upper().encode("utf-8")).hexdigest()
-
-        # There are two ways we know we're updating a task that was
-        # previously entered:
-        #   1. if a task id is given immediately before the
-        #      priority in brackets, or
-        #   2. if we can find a task with the same hash as this task's
-        #      description.
-        #
-        # So, first we try to find the task by id, then by hash.
-        task_id = task_data.get("id", None)
-        if task_id:
-            (task_id, task) = taskw.get_task(id=task_id)
-        else:
-            (task_id, task) = taskw.get_task(twi_hash=twi_hash)
+        if record:
+            if record["uuid"] in staged:
+                # The later line replaces the record already queued for
+                # import, attributes it drops included, as if the two
+                # lines had been imported one after the other
+                staged[record["uuid"]].clear()
+                staged[record["uuid"]].update(record)
+                record = staged[record["uuid"]]
+            else:
+                pending.append((line, record))
+                staged[record["uuid"]] = record
+
+            index.add(record)
+
+            if len(pending) >= IMPORT_CHUNK_SIZE:
+                commit_batch(taskw, pending, failed_lines)
+                pending = []
+                staged = {}
+            continue
 
-        # If we fail to retrieve a task, then we create a new one.
-        if not task_id:
-            try:
-                task = taskw.task_add(description, twi_hash=twi_hash)
-                task_id = task["id"]
+        # This line has to go through the regular add/modify path. That
+        # only has to wait for the batch when it updates a staged task.
+        if task and task["uuid"] in staged:
+            commit_batch(taskw, pending, failed_lines)
+            pending = []
+            staged = {}
 
-            except TaskwarriorError as err:
-                msg = err.stderr.decode("utf-8").split("\n")[-1]
-                failed_lines.append((line, msg))
-                continue
+        msg = commit_line(taskw, index, task, description, twi_hash,
+                          task_data)
+        if msg is not None:
+            failed_lines.append((line, msg))
 
-        # Attempt to update tasks
-        try:
-            for key, value in task_data.items():
-                task[key] = value
+    commit_batch(taskw, pending, failed_lines)
 
-            taskw.task_update(task)
+    if not dry_run:
+        index.sync(clean=not failed_lines)
 
-            # TODO: Figure out why descriptions get dropped
-            # This is here because task descriptions get dropped sometimes,
-            # and I don't really know why.
-            (_, task) = taskw.get_task(id=task_id)
-            if task["description"] != description:
-                task["description"] = description
-                taskw.task_update(task)
-        except TaskwarriorError as err:
-            msg = err.stderr.decode("utf-8").split("\n")[-1]
-            failed_lines.append((line, msg))
-            continue
+        if applied is not None:
+            applied |= attempted - set(get_line_hash(line)
+                                       for (line, _) in failed_lines)
 
     return failed_lines
-
@@ -1,44 +1,266 @@
 from taskw import TaskWarrior
-from time import sleep
-from datetime import timedelta
+from taskw.exceptions import TaskwarriorError
+from time import monotonic, sleep
+from math import ceil
+from collections import Counter
 from curses import (noecho, curs_set)
+from datetime import datetime, timezone
+from os import chmod, makedirs, path, unlink
 from subprocess import (run, DEVNULL)
+from sys import stderr
+import asyncio
 
+from parse import IMPORT_DATE_FORMAT, import_tasks
+from remote import POMODORO_SOCKET, get_socket_path
+from taskdata import load_backend
 
-def print_time(stdscr, task, clock):
-    stdscr.clear()
+# Column the minutes start at, after "Pomodoro: "
+CLOCK_COLUMN = 10
+
+NOTIFY_COMMAND = ["zenity", "--info", "--title=Pomodoro",
+                  "--text=Pomodoro Finished."]
+
+# Timers finishing within this many seconds of each other share a write
+POM_BATCH_DELAY = 2
+POM_WRITE_RETRIES = 5
+POM_RETRY_DELAY = 1
 
-    minutes = clock.seconds // 60
-    seconds = clock.seconds % 60
 
-    s = f'0{seconds}' if seconds < 10 else f'{seconds}'
-    m = f'0{minutes}' if minutes < 10 else f'{minutes}'
+def format_clock(seconds):
+    return f'{seconds // 60:02}:{seconds % 60:02}'
 
-    stdscr.addstr(0, 0, f'Pomodoro: {m}:{s}')
+
+def print_task(stdscr, task, clock):
+    stdscr.clear()
+    stdscr.addstr(0, 0, f'Pomodoro: {clock}')
     stdscr.addstr(2, 0, f'{task["description"]} '
                         f'({task.get("pom", 0)}'
                         f'/{task.get("effort", 0)})')
     stdscr.refresh()
 
 
+def print_time(stdscr, shown, clock):
+    # Only touch the characters that changed since the last tick, which
+    # is usually just the last digit. A clock that got shorter (100:00 to
+    # 99:59) is redrawn whole, clearing what's left of the old one.
+    if len(shown) != len(clock):
+        stdscr.addstr(0, CLOCK_COLUMN, clock)
+        stdscr.clrtoeol()
+    else:
+        for i, (old, new) in enumerate(zip(shown, clock)):
+            if old != new:
+                stdscr.addstr(0, CLOCK_COLUMN + i, new)
+    stdscr.refresh()
+
+
 def timer(stdscr, task_id, minutes=25):
     noecho()
     curs_set(False)
 
-    tw = TaskWarrior(marshal=True)
+    tw = load_backend(TaskWarrior(marshal=True))
     task = tw.get_task(id=task_id)[1]
-    clock = timedelta(minutes=minutes)
 
-    while clock > timedelta():
-        clock -= timedelta(seconds=1)
-        print_time(stdscr, task, clock)
-        sleep(1)
+    # Count down to a fixed deadline rather than a second per loop, so
+    # the time spent drawing and waking up late never adds up
+    seconds = round(minutes * 60)
+    deadline = monotonic() + seconds
+    shown = format_clock(seconds)
+    print_task(stdscr, task, shown)
+
+    remaining = deadline - monotonic()
+    while remaining > 0:
+        # Sleep until the display next needs to change
+        sleep(remaining - ceil(remaining) + 1)
+
+        remaining = deadline - monotonic()
+        clock = format_clock(max(ceil(remaining), 0))
+        print_time(stdscr, shown, clock)
+        shown = clock
 
     task["pom"] = task.get("pom", 0) + 1
     tw.task_update(task)
-    run(["zenity",
-         "--info",
-         "--title=Pomodoro",
-         "--text=Pomodoro Finished."],
-        stdout=DEVNULL,
-        stderr=DEVNULL)
+    run(NOTIFY_COMMAND, stdout=DEVNULL, stderr=DEVNULL)
+
+
+def describe_error(err):
+    if isinstance(err, TaskwarriorError):
+        return err.stderr.decode("utf-8").strip()
+    return f"{type(err).__name__}: {err}"
+
+
+def add_poms(tw, uuids):
+    # Bump the pom count of every finished task with a single export and
+    # a single import, however many timers went off
+    counts = Counter(uuids)
+    records = tw._get_json(*counts, "export")
+    now = datetime.now(timezone.utc).strftime(IMPORT_DATE_FORMAT)
+
+    for record in records:
+        record["pom"] = int(record.get("pom", 0)) + counts[record["uuid"]]
+        record["modified"] = now
+        record.pop("id", None)
+        record.pop("urgency", None)
+
+    if records:
+        import_tasks(tw, records)
+
+
+class PomodoroDaemon:
+    # Any number of timers, one per task, in a single process. Finished
+    # pomodoros are written back in batches off the event loop. Tasks are
+    # looked up in the Taskwarrior of the account running the daemon, so
+    # it's one daemon per account.
+    def __init__(self, tw):
+        self.tw = tw
+        self.timers = {}
+        self.finished = asyncio.Queue()
+
+        # Finished but not yet handed to Taskwarrior, for shutting down
+        self.batch = []
+        self.notifications = set()
+
+    async def get_task(self, task_id):
+        loop = asyncio.get_running_loop()
+        return (await loop.run_in_executor(None, lambda: self.tw.get_task(
+            id=task_id)))[1]
+
+    async def start(self, task_id, minutes):
+        task = await self.get_task(task_id)
+        if not task:
+            return f"No task with ID {task_id}"
+        if task["uuid"] in self.timers:
+            return f"{task['description']} already has a timer running"
+
+        # The event loop's clock is monotonic, so sleeping until the
+        # deadline can't drift
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + round(minutes * 60)
+        countdown = asyncio.create_task(self.countdown(task["uuid"],
+                                                       deadline))
+        self.timers[task["uuid"]] = (task, deadline, countdown)
+        return f"Started {task['description']}"
+
+    async def countdown(self, uuid, deadline):
+        await asyncio.sleep(deadline - asyncio.get_running_loop().time())
+        del self.timers[uuid]
+
+        self.finished.put_nowait(uuid)
+        notification = asyncio.create_task(notify())
+        self.notifications.add(notification)
+        notification.add_done_callback(self.notifications.discard)
+
+    async def stop(self, task_id):
+        task = await self.get_task(task_id)
+        if not task or task["uuid"] not in self.timers:
+            return f"Task {task_id} has no timer running"
+
+        self.timers.pop(task["uuid"])[2].cancel()
+        return f"Stopped {task['description']}. Pomodoro not counted."
+
+    def status(self):
+        now = asyncio.get_running_loop().time()
+        lines = []
+        for task, deadline, _ in sorted(self.timers.values(),
+                                        key=lambda timer: timer[1]):
+            clock = format_clock(max(ceil(deadline - now), 0))
+            lines.append(f"{task['id']:<4} {clock}  {task['description']} "
+                         f"({task.get('pom', 0)}/{task.get('effort', 0)})")
+
+        return "\n".join(lines) or "No timers running"
+
+    async def handle(self, reader, writer):
+        try:
+            words = (await reader.readline()).decode("utf-8",
+                                                     "replace").split()
+            if words[:1] == ["start"] and len(words) == 3:
+                reply = await self.start(int(words[1]), float(words[2]))
+            elif words[:1] == ["stop"] and len(words) == 2:
+                reply = await self.stop(int(words[1]))
+            elif words == ["status"]:
+                reply = self.status()
+            else:
+                reply = "Unknown command: " + " ".join(words)
+        except ValueError:
+            reply = "Task ID and minutes must be numbers"
+        except Exception as err:
+            # The client is waiting on an answer whatever went wrong
+            reply = describe_error(err)
+
+        try:
+            writer.write((reply + "\n").encode("utf-8"))
+            await writer.drain()
+        except OSError:
+            pass
+        finally:
+            writer.close()
+
+    async def write_poms(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            uuids = self.batch = [await self.finished.get()]
+            await asyncio.sleep(POM_BATCH_DELAY)
+            while not self.finished.empty():
+                uuids.append(self.finished.get_nowait())
+
+            # Taskwarrior being busy (a lock held by another command, say)
+            # shouldn't lose anyone's pomodoro
+            for attempt in range(POM_WRITE_RETRIES):
+                self.batch = []
+                try:
+                    await loop.run_in_executor(None, add_poms, self.tw, uuids)
+                    break
+                except Exception as err:
+                    # Whatever it was (no `task` binary, say), the writer
+                    # has to keep going for every later pomodoro
+                    self.batch = uuids
+                    error = describe_error(err)
+                    await asyncio.sleep(POM_RETRY_DELAY * 2 ** attempt)
+            else:
+                stderr.write(f"Could not count {len(uuids)} pomodoros: "
+                             f"{error}\n")
+                self.batch = []
+
+    async def serve(self, socket_path):
+        makedirs(path.dirname(socket_path), mode=0o700, exist_ok=True)
+        if path.exists(socket_path):
+            unlink(socket_path)
+
+        server = await asyncio.start_unix_server(self.handle, socket_path)
+        # Only the account whose tasks these are may start and stop timers
+        chmod(socket_path, 0o600)
+        writer = asyncio.create_task(self.write_poms())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer.cancel()
+            unlink(socket_path)
+
+            # Whatever finished during the last batch delay still counts
+            uuids = self.batch
+            while not self.finished.empty():
+                uuids.append(self.finished.get_nowait())
+            if uuids:
+                try:
+                    add_poms(self.tw, uuids)
+                except Exception as err:
+                    stderr.write(f"Could not count {len(uuids)} pomodoros: "
+                                 f"{describe_error(err)}\n")
+
+
+async def notify():
+    # Run alongside the timers rather than holding them up
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *NOTIFY_COMMAND, stdout=DEVNULL, stderr=DEVNULL)
+        await process.wait()
+    except OSError:
+        pass
+
+
+def run_daemon():
+    daemon = PomodoroDaemon(load_backend(TaskWarrior()))
+    try:
+        asyncio.run(daemon.serve(get_socket_path(POMODORO_SOCKET)))
+    except KeyboardInterrupt:
+        pass
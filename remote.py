@@ -0,0 +1,68 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+# The socket clients, kept apart from the daemons so that talking to one
+# doesn't cost importing taskw, curses or the parsers.
+
+from json import dumps, loads
+from os import environ, path
+from socket import AF_UNIX, SHUT_WR, SOCK_STREAM, socket
+
+POMODORO_SOCKET = "twinput-pomodoro.sock"
+SERVER_SOCKET = "twinput.sock"
+
+# Input lines sent to the server per request
+LINES_PER_REQUEST = 1000
+
+
+def get_runtime_dir():
+    # Where the daemons put their sockets, next to the cache otherwise
+    runtime_dir = environ.get("XDG_RUNTIME_DIR", None)
+    if runtime_dir:
+        return runtime_dir
+
+    cache_home = environ.get("XDG_CACHE_HOME", path.expanduser("~/.cache"))
+    return path.join(cache_home, "twinput")
+
+
+def get_socket_path(name):
+    return path.join(get_runtime_dir(), name)
+
+
+def send(name, message):
+    # One message per connection, the daemon hangs up once it's answered
+    with socket(AF_UNIX, SOCK_STREAM) as sock:
+        sock.connect(get_socket_path(name))
+        sock.sendall(message.encode("utf-8") + b"\n")
+        sock.shutdown(SHUT_WR)
+        reply = b"".join(iter(lambda: sock.recv(65536), b""))
+
+    return reply.decode("utf-8")
+
+
+def send_command(*words):
+    return send(POMODORO_SOCKET, " ".join(words))
+
+
+def send_request(request):
+    return loads(send(SERVER_SOCKET, dumps(request)))
+
+
+def server_running():
+    try:
+        return send_request({"source": "ping"}) == {}
+    except (OSError, ValueError):
+        return False
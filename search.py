@@ -0,0 +1,151 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import defaultdict
+
+GRAM_SIZE = 3
+
+
+def get_search_text(task):
+    fields = [task["description"], task.get("project", None) or ""]
+    fields.extend(task.get("tags", None) or [])
+    return " ".join(fields).lower()
+
+
+def get_grams(text):
+    # Every substring of up to three characters, so one- and two-letter
+    # queries are answered by the index as well
+    grams = set()
+    for size in range(1, GRAM_SIZE + 1):
+        grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+    return grams
+
+
+class SearchIndex:
+    # N-gram index over description, project and tags, plus project and
+    # context groupings for facets. Kept current as tasks change, so it's
+    # only ever built once per load.
+    def __init__(self, tasks=()):
+        self.texts = {}
+        self.grams = defaultdict(set)
+        self.projects = defaultdict(set)
+        self.contexts = defaultdict(set)
+
+        for task in tasks:
+            self.add(task)
+
+    def add(self, task):
+        uuid = str(task["uuid"])
+        text = get_search_text(task)
+
+        self.texts[uuid] = text
+        for gram in get_grams(text):
+            self.grams[gram].add(uuid)
+        if task.get("project", None):
+            self.projects[task["project"].lower()].add(uuid)
+        for tag in task.get("tags", None) or []:
+            self.contexts[tag.lower()].add(uuid)
+
+    def remove(self, task):
+        uuid = str(task["uuid"])
+        text = self.texts.pop(uuid, None)
+        if text is None:
+            return
+
+        for gram in get_grams(text):
+            self.grams[gram].discard(uuid)
+        for groups in (self.projects, self.contexts):
+            for group in groups.values():
+                group.discard(uuid)
+
+    def update(self, task):
+        self.remove(task)
+        self.add(task)
+
+    def get_project(self, name):
+        # Facets match by prefix, which also takes in subprojects, and
+        # keeps typing a facet one letter at a time a narrowing search
+        matches = set()
+        for project, uuids in self.projects.items():
+            if project.startswith(name):
+                matches |= uuids
+        return matches
+
+    def get_context(self, name):
+        matches = set()
+        for context, uuids in self.contexts.items():
+            if context.startswith(name):
+                matches |= uuids
+        return matches
+
+    def get_word_grams(self, word):
+        # The uuid sets for every piece of the word, rarest first, so each
+        # intersection is with the smallest results so far
+        if len(word) <= GRAM_SIZE:
+            return [self.grams.get(word, set())]
+
+        grams = set(word[i:i + GRAM_SIZE]
+                    for i in range(len(word) - GRAM_SIZE + 1))
+        return sorted((self.grams.get(gram, set()) for gram in grams),
+                      key=len)
+
+    def search(self, query, within=None):
+        # Returns the uuids matching every word of the query. +PROJECT and
+        # @CONTEXT words use the facets, everything else must appear in the
+        # description, project or tags.
+        #
+        # `within` can be the results for the query as it was one keystroke
+        # ago. Those already satisfy every word but the last, so only the
+        # last word is applied, and only to them. A space ends the last
+        # word without changing it, so there's nothing to apply at all.
+        if within is not None and query[-1:].isspace():
+            return within
+
+        words = query.lower().split()
+        if within is not None:
+            words = words[-1:]
+        results = within
+
+        for word in words:
+            # A facet that's only been started on doesn't narrow anything
+            # yet, or typing the name after it would have nothing to narrow
+            if word in ("+", "@"):
+                continue
+            elif word.startswith("+"):
+                results = narrow(results, self.get_project(word[1:]))
+                continue
+            elif word.startswith("@"):
+                results = narrow(results, self.get_context(word[1:]))
+                continue
+
+            # Short words are in the index as they are. Longer ones are
+            # narrowed by every piece, and only what has all of them is
+            # checked for the whole word.
+            for uuids in self.get_word_grams(word):
+                results = narrow(results, uuids)
+                if not results:
+                    break
+            if results and len(word) > GRAM_SIZE:
+                results = set(uuid for uuid in results
+                              if word in self.texts[uuid])
+
+        return set(self.texts) if results is None else results
+
+
+def narrow(results, uuids):
+    if results is None:
+        return set(uuids)
+    return results & uuids
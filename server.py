@@ -0,0 +1,177 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from json import dumps, loads
+from os import chmod, makedirs, path, stat, unlink
+from socketserver import StreamRequestHandler, UnixStreamServer
+from taskw import TaskWarrior
+from taskw.exceptions import TaskwarriorError
+
+from parse import (complete_todos, find_repos, get_error_message,
+                   git_grep_repos, git_grep_todos, mark_org_todos,
+                   parse_todos, read_pim, save_git_scans)
+from remote import SERVER_SOCKET, get_socket_path
+from taskdata import load_backend
+from taskindex import get_data_signature, load_index
+
+
+def get_config_signature(taskw):
+    try:
+        info = stat(taskw.config_filename)
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+class TwinputServer:
+    # Keeps the Taskwarrior client (and its parsed config), the task index
+    # and the scan manifests between imports. The index is dropped whenever
+    # Taskwarrior's data files change behind the server's back, the client
+    # whenever the taskrc does.
+    def __init__(self):
+        self.taskw = None
+        self.config = None
+        self.index = None
+        self.signature = None
+
+    def get_index(self):
+        if self.taskw is None or (get_config_signature(self.taskw)
+                                  != self.config):
+            self.taskw = load_backend(TaskWarrior())
+            self.config = get_config_signature(self.taskw)
+            self.index = None
+
+        signature = get_data_signature(self.taskw)
+        if self.index is None or signature != self.signature:
+            self.index = load_index(self.taskw)
+            self.signature = signature
+
+        return self.index
+
+    def harvest(self, request, vanished, scans, marks):
+        dry_run = request.get("dry_run", False)
+        if request["source"] == "gitgrep":
+            repos = list(request.get("repos", []))
+            if request.get("root", None):
+                repos += find_repos(request["root"])
+
+            if repos:
+                return git_grep_repos(repos, request.get("jobs", 8),
+                                      full=request.get("full", False),
+                                      vanished=vanished, dry_run=dry_run,
+                                      scans=scans)
+            return git_grep_todos(request["cwd"],
+                                  full=request.get("full", False),
+                                  vanished=vanished, dry_run=dry_run,
+                                  scans=scans)
+        elif request["source"] == "orgmode":
+            return read_pim(request["pim"], None if dry_run else marks)
+        elif request["source"] == "lines":
+            return request["lines"]
+
+        raise ValueError(f"Unknown source: {request['source']}")
+
+    def handle(self, request):
+        if request.get("source", None) == "ping":
+            return {}
+
+        dry_run = request.get("dry_run", False)
+        # Only retried input comes with the hashes applied so far
+        known = request.get("applied", None)
+        applied = set(known) if known is not None else None
+        plan = []
+        vanished = []
+        scans = []
+        marks = []
+
+        def report(action, line):
+            if dry_run or action == "applied":
+                plan.append([action, line])
+
+        index = self.get_index()
+        lines = self.harvest(request, vanished, scans, marks)
+
+        if dry_run:
+            failed = parse_todos(self.taskw, lines, index=index, dry_run=True,
+                                 report=report, applied=applied)
+
+            # The planned tasks went into the index as if they'd been
+            # written, so it can't be used again
+            self.index = None
+            return {"failed": failed, "vanished": vanished, "plan": plan,
+                    "applied": []}
+
+        failed = parse_todos(self.taskw, lines, index=index, report=report,
+                             applied=applied)
+        if request.get("prune", False):
+            failed += complete_todos(self.taskw, vanished, index=index)
+
+        # Anything that failed is harvested again next time
+        if not failed:
+            save_git_scans(scans)
+        mark_org_todos(marks, failed)
+
+        # Our own writes changed the data files, but the index already
+        # has them, unless something failed half way
+        self.signature = (get_data_signature(self.taskw)
+                          if not failed else None)
+
+        # Only what this request applied, the client has the rest
+        return {"failed": failed, "vanished": vanished, "plan": plan,
+                "applied": list(applied.difference(known))
+                if applied is not None else []}
+
+
+class RequestHandler(StreamRequestHandler):
+    def handle(self):
+        try:
+            request = loads(self.rfile.readline().decode("utf-8"))
+            reply = self.server.twinput.handle(request)
+        except TaskwarriorError as err:
+            self.server.twinput.signature = None
+            reply = {"error": get_error_message(err)}
+        except (OSError, ValueError) as err:
+            reply = {"error": str(err)}
+        except KeyError as err:
+            reply = {"error": f"Missing {err} in request"}
+        except Exception as err:
+            # Whatever it was, the client gets an answer rather than a
+            # hang up, and the index is rebuilt in case it was half updated
+            self.server.twinput.signature = None
+            reply = {"error": f"{type(err).__name__}: {err}"}
+
+        self.wfile.write(dumps(reply).encode("utf-8") + b"\n")
+
+
+def run_server():
+    # Requests are handled one at a time, so imports never race each other
+    # for the index or Taskwarrior's lock
+    socket_path = get_socket_path(SERVER_SOCKET)
+    makedirs(path.dirname(socket_path), mode=0o700, exist_ok=True)
+    if path.exists(socket_path):
+        unlink(socket_path)
+
+    with UnixStreamServer(socket_path, RequestHandler) as server:
+        # Requests name paths to import from and org files to rewrite, so
+        # only the account running the server may send them
+        chmod(socket_path, 0o600)
+        server.twinput = TwinputServer()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            unlink(socket_path)
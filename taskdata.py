@@ -0,0 +1,294 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from json import loads
+from os import path, stat
+from re import compile
+from sqlite3 import connect, Error as SQLiteError
+
+from taskindex import get_data_location
+
+# Taskwarrior 2.x keeps one task per line, as [name:"value" ...]
+FF4_ATTRIBUTE_RE = compile(r'([^\s:\[\]]+):"((?:[^"\\]|\\.)*)"')
+FF4_ESCAPES = (("&open;", "["), ("&close;", "]"), ("&dquot;", '"'))
+
+EXPORT_DATE_FORMAT = "%Y%m%dT%H%M%SZ"
+DATE_ATTRIBUTES = ("entry", "start", "end", "due", "until", "wait",
+                   "scheduled", "modified")
+NUMERIC_ATTRIBUTES = ("imask",)
+
+# What `task export` counts as pending, and what gets an ID in 2.x
+PENDING_STATUSES = ("pending", "waiting")
+WORKING_SET_STATUSES = PENDING_STATUSES + ("recurring",)
+
+
+def decode_ff4_value(value):
+    if "&" in value:
+        for escape, character in FF4_ESCAPES:
+            value = value.replace(escape, character)
+
+    if "\\" not in value:
+        return value
+
+    try:
+        return loads(f'"{value}"')
+    except ValueError:
+        return value
+
+
+def read_ff4_file(data_path):
+    tasks = []
+    with open(data_path, "r", encoding="utf-8") as data_file:
+        for line in data_file:
+            if line.startswith("["):
+                tasks.append({name: decode_ff4_value(value) for name, value
+                              in FF4_ATTRIBUTE_RE.findall(line)})
+
+    return tasks
+
+
+def read_ff4_tasks(location, data_file):
+    # Tags and dependencies are comma separated, annotations are stored as
+    # annotation_EPOCH attributes.
+    tasks = read_ff4_file(path.join(location, data_file))
+    for task in tasks:
+        for name in ("tags", "depends"):
+            if task.get(name, None):
+                task[name] = task[name].split(",")
+            else:
+                task.pop(name, None)
+
+    return tasks
+
+
+def read_taskchampion_tasks(location, data_file):
+    # Taskwarrior 3.x keeps every task as a flat JSON map of strings, with
+    # one tag_NAME or dep_UUID key per tag or dependency, and the IDs in a
+    # separate working set table.
+    db = connect(f"file:{path.join(location, data_file)}?mode=ro", uri=True)
+    try:
+        rows = db.execute("SELECT uuid, data FROM tasks").fetchall()
+        working_set = dict(db.execute("SELECT uuid, id FROM working_set "
+                                      "WHERE uuid IS NOT NULL").fetchall())
+    finally:
+        db.close()
+
+    tasks = []
+    for uuid, data in rows:
+        task = {"uuid": uuid}
+        for name, value in loads(data).items():
+            if name.startswith("tag_"):
+                task.setdefault("tags", []).append(name[4:])
+            elif name.startswith("dep_"):
+                task.setdefault("depends", []).append(name[4:])
+            else:
+                task[name] = value
+
+        if uuid in working_set:
+            task["id"] = working_set[uuid]
+        tasks.append(task)
+
+    return tasks
+
+
+# Entry and modification times repeat a lot across a task list
+@lru_cache(maxsize=4096)
+def to_export_date(value):
+    return datetime.fromtimestamp(int(value), timezone.utc).strftime(
+        EXPORT_DATE_FORMAT)
+
+
+def to_number(value):
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+class TaskData:
+    # Reads tasks straight out of Taskwarrior's data files and hands them
+    # back shaped like `task export` would. Each file is only parsed again
+    # once its mtime or size changes.
+    def __init__(self, location, udas=None):
+        self.location = location
+        self.cache = {}
+
+        # UDA types decide how values are exported, like Taskwarrior does
+        self.dates = set(DATE_ATTRIBUTES)
+        self.numbers = set(NUMERIC_ATTRIBUTES)
+        for name, uda in (udas or {}).items():
+            uda_type = uda.get("type", None) if isinstance(uda, dict) else None
+            if uda_type == "date":
+                self.dates.add(name)
+            elif uda_type == "numeric":
+                self.numbers.add(name)
+
+        if path.exists(path.join(location, "taskchampion.sqlite3")):
+            self.files = {"pending": "taskchampion.sqlite3",
+                          "completed": "taskchampion.sqlite3"}
+            self.reader = read_taskchampion_tasks
+        elif path.exists(path.join(location, "pending.data")):
+            self.files = {"pending": "pending.data",
+                          "completed": "completed.data"}
+            self.reader = read_ff4_tasks
+        else:
+            raise ValueError(f"No Taskwarrior data found in {location}")
+
+    def get_signature(self, data_file):
+        signature = []
+        for suffix in ("", "-wal"):
+            try:
+                info = stat(path.join(self.location, data_file + suffix))
+            except OSError:
+                continue
+            signature.append((info.st_mtime_ns, info.st_size))
+
+        return signature
+
+    def read(self, data_file):
+        signature = self.get_signature(data_file)
+        cached = self.cache.get(data_file, None)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+        tasks = (self.reader(self.location, data_file)
+                 if signature else [])
+
+        # 2.x numbers the working set in pending.data's order
+        tasks = self.export(tasks, self.reader is read_ff4_tasks
+                            and data_file == self.files["pending"])
+        self.cache[data_file] = (signature, tasks)
+        return tasks
+
+    def export(self, tasks, working_set=False):
+        now = datetime.now(timezone.utc).timestamp()
+
+        next_id = 1
+        for task in tasks:
+            # Waiting is a status `task export` works out, not one that's
+            # always stored
+            wait = task.get("wait", None)
+            if (task.get("status", None) == "pending" and wait
+                    and int(wait) > now):
+                task["status"] = "waiting"
+
+            status = task.get("status", None)
+            if working_set and status in WORKING_SET_STATUSES:
+                task["id"] = next_id
+                next_id += 1
+
+            annotations = []
+            for name in [name for name in task
+                         if name.startswith("annotation_")]:
+                annotations.append({"entry": to_export_date(name[11:]),
+                                    "description": task.pop(name)})
+            if annotations:
+                task["annotations"] = sorted(annotations,
+                                             key=lambda a: a["entry"])
+
+            for name, value in task.items():
+                if name in self.dates:
+                    task[name] = to_export_date(value)
+                elif name in self.numbers:
+                    task[name] = to_number(value)
+            task.setdefault("id", 0)
+
+        return tasks
+
+    def pending(self):
+        return [task for task in self.read(self.files["pending"])
+                if task.get("status", None) in PENDING_STATUSES]
+
+    def completed(self):
+        return [task for task in self.read(self.files["completed"])
+                if task.get("status", None) == "completed"]
+
+    def find(self, name, value):
+        # Pending tasks are the ones asked about nearly every time, so the
+        # completed file is only read on a miss
+        value = str(value)
+        for data_file in dict.fromkeys(self.files.values()):
+            for task in self.read(data_file):
+                if str(task.get(name, None)) == value:
+                    return task
+
+        return None
+
+
+class DirectTaskWarrior:
+    # Answers the reads twinput does most from the data files, and passes
+    # everything else, writes above all, through to the `task` CLI client.
+    def __init__(self, taskw, data):
+        self.taskw = taskw
+        self.data = data
+
+    def __getattr__(self, name):
+        return getattr(self.taskw, name)
+
+    def load_tasks(self, command="all"):
+        if command not in ("pending", "completed", "all"):
+            return self.taskw.load_tasks(command)
+
+        try:
+            tasks = {}
+            if command in ("pending", "all"):
+                tasks["pending"] = self.data.pending()
+            if command in ("completed", "all"):
+                tasks["completed"] = self.data.completed()
+        except (OSError, ValueError, SQLiteError):
+            return self.taskw.load_tasks(command)
+
+        return {status: [self.get_task_object(task) for task in records]
+                for status, records in tasks.items()}
+
+    def get_task(self, **kw):
+        if len(kw) != 1 or not kw.keys() & {"id", "uuid"}:
+            return self.taskw.get_task(**kw)
+
+        ((name, value),) = kw.items()
+        try:
+            task = self.data.find(name, value)
+        except (OSError, ValueError, SQLiteError):
+            return self.taskw.get_task(**kw)
+
+        if not task:
+            return None, {}
+
+        task_id = task["id"] if task["status"] in PENDING_STATUSES else None
+        return task_id, self.get_task_object(task)
+
+    def get_task_object(self, task):
+        # Callers are free to change what they get, the cache isn't theirs
+        task = dict(task)
+        for name in ("tags", "depends"):
+            if name in task:
+                task[name] = list(task[name])
+        if "annotations" in task:
+            task["annotations"] = [dict(annotation)
+                                   for annotation in task["annotations"]]
+
+        return self.taskw._get_task_object(task)
+
+
+def load_backend(taskw):
+    # Fall back to the CLI client for any layout we can't read
+    try:
+        data = TaskData(get_data_location(taskw),
+                        taskw.config.get("uda", {}))
+    except (OSError, ValueError):
+        return taskw
+
+    return DirectTaskWarrior(taskw, data)
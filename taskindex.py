@@ -0,0 +1,233 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from json import dumps, loads
+from os import path, stat
+from sqlite3 import connect, Error as SQLiteError
+from taskw.exceptions import TaskwarriorError
+
+# Files Taskwarrior 2.x and 3.x keep their tasks in. Any change to one of
+# these invalidates the on-disk index.
+DATA_FILES = ("pending.data", "completed.data", "taskchampion.sqlite3")
+INDEX_FILE = "twinput-index.sqlite3"
+
+# Tasks read back per `task export` once a run's writes are done
+EXPORT_CHUNK_SIZE = 1000
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tasks (uuid TEXT PRIMARY KEY,
+                                  id TEXT,
+                                  twi_hash TEXT,
+                                  data TEXT);
+CREATE INDEX IF NOT EXISTS tasks_id ON tasks (id);
+CREATE INDEX IF NOT EXISTS tasks_twi_hash ON tasks (twi_hash);
+"""
+
+
+class TaskIndex:
+    def __init__(self, tasks=()):
+        self.by_uuid = {}
+        self.by_id = {}
+        self.by_hash = {}
+
+        for task in tasks:
+            self.add(task)
+
+    def __len__(self):
+        return len(self.by_uuid)
+
+    def add(self, task):
+        # Records staged for import don't carry an id, so keep whatever id
+        # Taskwarrior gave the task when the index was loaded.
+        old = self.by_uuid.get(task["uuid"], {})
+        task_id = task.get("id", None) or old.get("id", None)
+
+        self.by_uuid[task["uuid"]] = task
+        if task_id:
+            self.by_id[str(task_id)] = task
+        if task.get("twi_hash", None):
+            self.by_hash[task["twi_hash"]] = task
+
+    def remove(self, task):
+        old = self.by_uuid.pop(task["uuid"], None)
+        if not old:
+            return
+
+        for index in (self.by_id, self.by_hash):
+            for key in [k for k, v in index.items() if v is old]:
+                del index[key]
+
+    def get(self, id=None, twi_hash=None):
+        if id:
+            return self.by_id.get(str(id), None)
+
+        return self.by_hash.get(twi_hash, None)
+
+    def sync(self, clean=True):
+        pass
+
+
+class PersistentTaskIndex(TaskIndex):
+    # Keeps the pending tasks in an SQLite file next to Taskwarrior's data,
+    # so a run only has to export anything when the data files changed
+    # since the index was written. Completed, deleted or modified tasks
+    # always touch the data files, which invalidates the index.
+    def __init__(self, taskw, index_path):
+        super().__init__()
+        self.taskw = taskw
+        self.changed = {}
+
+        self.db = connect(index_path)
+        self.db.executescript(INDEX_SCHEMA)
+
+        row = self.db.execute("SELECT value FROM meta "
+                              "WHERE key = 'signature'").fetchone()
+        if not row or loads(row[0]) != get_data_signature(taskw):
+            self.rebuild()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def rebuild(self):
+        tasks = self.taskw.load_tasks("pending")["pending"]
+
+        with self.db:
+            self.db.execute("DELETE FROM tasks")
+            self.db.executemany("INSERT OR REPLACE INTO tasks "
+                                "VALUES (?, ?, ?, ?)",
+                                [get_row(task) for task in tasks])
+            self.set_signature(get_data_signature(self.taskw))
+
+    def set_signature(self, signature):
+        if signature is None:
+            self.db.execute("DELETE FROM meta WHERE key = 'signature'")
+        else:
+            self.db.execute("INSERT OR REPLACE INTO meta "
+                            "VALUES ('signature', ?)", (dumps(signature),))
+
+    def add(self, task):
+        super().add(task)
+        self.changed[task["uuid"]] = self.by_uuid[task["uuid"]]
+
+    def remove(self, task):
+        super().remove(task)
+        self.changed.pop(task["uuid"], None)
+        with self.db:
+            self.db.execute("DELETE FROM tasks WHERE uuid = ?",
+                            (task["uuid"],))
+
+    def get(self, id=None, twi_hash=None):
+        # Tasks seen during this run take precedence over the file
+        task = super().get(id=id, twi_hash=twi_hash)
+        if task:
+            return task
+
+        if id:
+            row = self.db.execute("SELECT data FROM tasks WHERE id = ? "
+                                  "ORDER BY rowid DESC", (str(id),))
+        else:
+            row = self.db.execute("SELECT data FROM tasks "
+                                  "WHERE twi_hash = ? ORDER BY rowid DESC",
+                                  (twi_hash,))
+        row = row.fetchone()
+        if not row:
+            return None
+
+        task = loads(row[0])
+        if task["uuid"] in self.by_uuid:
+            return self.by_uuid[task["uuid"]]
+
+        super().add(task)
+        return task
+
+    def export(self, uuids):
+        tasks = []
+        for start in range(0, len(uuids), EXPORT_CHUNK_SIZE):
+            tasks += self.taskw._get_json(
+                *uuids[start:start + EXPORT_CHUNK_SIZE], "export")
+
+        return tasks
+
+    def sync(self, clean=True):
+        # Write back what this run changed. The data files changed too,
+        # so the index is only marked current again if every write went
+        # through; otherwise the next run rebuilds it. Records staged for
+        # import carry no id (new tasks don't have one yet), so what was
+        # written is read back as Taskwarrior stored it first.
+        if not self.changed:
+            return
+
+        tasks = list(self.changed.values())
+        if clean:
+            try:
+                tasks = self.export(list(self.changed))
+            except TaskwarriorError:
+                clean = False
+
+        if clean:
+            for task in tasks:
+                TaskIndex.add(self, task)
+
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO tasks "
+                                "VALUES (?, ?, ?, ?)",
+                                [get_row(task) for task in tasks])
+            self.set_signature(get_data_signature(self.taskw)
+                               if clean else None)
+
+        self.changed = {}
+
+
+def get_row(task):
+    task_id = task.get("id", None)
+    return (task["uuid"],
+            str(task_id) if task_id else None,
+            task.get("twi_hash", None),
+            dumps(task))
+
+
+def get_data_location(taskw):
+    location = taskw.config.get("data", {}).get("location", "~/.task")
+    return path.expanduser(location)
+
+
+def get_data_signature(taskw):
+    location = get_data_location(taskw)
+
+    signature = []
+    for data_file in DATA_FILES:
+        try:
+            info = stat(path.join(location, data_file))
+        except OSError:
+            continue
+        signature.append([data_file, info.st_mtime_ns, info.st_size])
+
+    return signature
+
+
+def load_index(taskw, persistent=True):
+    # Only pending (and waiting) tasks are ever updated by twinput,
+    # anything else with a matching hash gets re-created, so there's no
+    # need to pull completed tasks into the index.
+    if persistent:
+        try:
+            return PersistentTaskIndex(
+                taskw, path.join(get_data_location(taskw), INDEX_FILE))
+        except SQLiteError:
+            pass
+
+    return TaskIndex(taskw.load_tasks("pending")["pending"])
@@ -0,0 +1,23 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from os import path
+from sys import path as sys_path
+
+# The modules sit at the top of the tree, and the benchmarks' fake
+# Taskwarrior is shared with the tests
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+sys_path[:0] = [ROOT, path.join(ROOT, "bench")]
@@ -0,0 +1,105 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from os import makedirs
+from subprocess import run
+
+from fakewarrior import FakeTaskWarrior
+from parse import git_grep_todos, parse_todos, save_git_scans
+
+TODO_LINE = "fix this thing @code twi_file:a.py twi_line:1"
+
+
+def git(repo, *args):
+    run(["git", "-c", "user.name=twinput", "-c", "user.email=twinput@test",
+         "-c", "commit.gpgsign=false"] + list(args),
+        cwd=repo, check=True, capture_output=True)
+
+
+def make_repo(repo):
+    makedirs(repo)
+    with open(repo / ".twparse", "w") as template:
+        template.write("${TODO} @code\n")
+    with open(repo / "a.py", "w") as source:
+        source.write("# TODO: fix this thing\n")
+
+    git(repo, "init", "-q")
+    git(repo, "add", ".")
+    git(repo, "commit", "-q", "-m", "init")
+    return str(repo)
+
+
+def make_taskw(location):
+    makedirs(location)
+    return FakeTaskWarrior(str(location))
+
+
+def test_dry_run_then_real_run_imports(tmp_path):
+    repo = make_repo(tmp_path / "repo")
+    taskw = make_taskw(tmp_path / "data")
+
+    scans = []
+    assert list(git_grep_todos(repo, dry_run=True, scans=scans)) == [
+        TODO_LINE]
+    assert scans == []
+
+    scans = []
+    assert parse_todos(taskw, git_grep_todos(repo, scans=scans)) == []
+    save_git_scans(scans)
+    assert [task["description"] for task
+            in taskw.load_tasks("pending")["pending"]] == ["fix this thing"]
+
+    # Nothing changed since the saved scan
+    assert list(git_grep_todos(repo, scans=[])) == []
+
+
+def test_unsaved_scan_harvests_again(tmp_path):
+    # A failed import never saves its scan
+    repo = make_repo(tmp_path / "repo")
+
+    assert list(git_grep_todos(repo, scans=[])) == [TODO_LINE]
+    assert list(git_grep_todos(repo, scans=[])) == [TODO_LINE]
+
+
+def test_dry_run_keeps_vanished_todos(tmp_path):
+    repo = make_repo(tmp_path / "repo")
+    scans = []
+    list(git_grep_todos(repo, scans=scans))
+    save_git_scans(scans)
+
+    with open(tmp_path / "repo" / "a.py", "w") as source:
+        source.write("print('done')\n")
+
+    for _ in range(2):
+        vanished = []
+        list(git_grep_todos(repo, vanished=vanished, dry_run=True,
+                            scans=scans))
+        assert vanished == [TODO_LINE]
+
+
+def test_renamed_file_todos_vanish(tmp_path):
+    repo = make_repo(tmp_path / "repo")
+    scans = []
+    list(git_grep_todos(repo, scans=scans))
+    save_git_scans(scans)
+
+    git(repo, "mv", "a.py", "b.py")
+    git(repo, "commit", "-q", "-m", "rename")
+
+    vanished = []
+    assert list(git_grep_todos(repo, vanished=vanished, scans=[])) == [
+        "fix this thing @code twi_file:b.py twi_line:1"]
+    assert vanished == [TODO_LINE]
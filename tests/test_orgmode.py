@@ -0,0 +1,93 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from os import makedirs
+
+from pytest import mark
+
+import parse
+from fakewarrior import FakeTaskWarrior
+from legacy import parse_org_mode as legacy_parse_org_mode
+from orgparse import generate_corpus
+from parse import mark_org_todos, parse_org_mode, parse_todos, read_pim
+
+AGENDA = """* TODO write report
+* TODO [#A]
+* DONE file taxes
+"""
+
+# A headline with no text can't be imported
+FAILED_LINE = "(U)  @home"
+
+
+def test_parser_matches_legacy_parser(tmp_path):
+    for org_file in generate_corpus(str(tmp_path), 256 * 1024, 8):
+        tasks = "".join(task + "\n" for task in parse_org_mode(org_file))
+        assert tasks
+        assert tasks == legacy_parse_org_mode(org_file)
+
+
+def make_pim(pim_dir):
+    makedirs(pim_dir)
+    with open(pim_dir / "agenda.org", "w") as agenda:
+        agenda.write(AGENDA)
+
+
+def import_pim(taskw, pim_dir, marks):
+    failed = parse_todos(taskw, read_pim(str(pim_dir), marks))
+    if marks is not None:
+        mark_org_todos(marks, failed)
+    return failed
+
+
+@mark.parametrize("pool_min_files", [parse.ORG_POOL_MIN_FILES, 1])
+def test_only_imported_headlines_are_tasked(tmp_path, monkeypatch,
+                                            pool_min_files):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setattr(parse, "ORG_POOL_MIN_FILES", pool_min_files)
+    make_pim(tmp_path / "pim")
+    makedirs(tmp_path / "data")
+    taskw = FakeTaskWarrior(str(tmp_path / "data"))
+
+    # A dry run leaves the file alone
+    assert len(import_pim(taskw, tmp_path / "pim", None)) == 1
+    with open(tmp_path / "pim" / "agenda.org") as agenda:
+        assert agenda.read() == AGENDA
+
+    failed = import_pim(taskw, tmp_path / "pim", [])
+    assert [line for (line, _) in failed] == [FAILED_LINE]
+    with open(tmp_path / "pim" / "agenda.org") as agenda:
+        assert agenda.read() == AGENDA.replace("TODO write", "TASKED write")
+
+    # The file with the failed headline is read again, and only what's
+    # still a TODO comes out of it
+    assert list(read_pim(str(tmp_path / "pim"))) == [FAILED_LINE]
+
+
+def test_rewrite_only_changes_the_keyword(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    makedirs(tmp_path / "pim")
+    content = b"* TODO a\r\nbody\r\n* TODO b\r\n"
+    with open(tmp_path / "pim" / "agenda.org", "wb") as agenda:
+        agenda.write(content)
+    makedirs(tmp_path / "data")
+    taskw = FakeTaskWarrior(str(tmp_path / "data"))
+
+    assert import_pim(taskw, tmp_path / "pim", []) == []
+    with open(tmp_path / "pim" / "agenda.org", "rb") as agenda:
+        assert agenda.read() == content.replace(b"TODO", b"TASKED")
+    assert sorted(task["description"] for task
+                  in taskw.load_tasks("pending")["pending"]) == ["a", "b"]
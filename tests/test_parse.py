@@ -0,0 +1,62 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from os import makedirs
+
+from fakewarrior import FakeTaskWarrior
+from legacy import parse_line as legacy_parse_line
+from parse import get_task_data, parse_line, parse_todos
+from tokenizer import generate_lines
+
+
+def test_tokenizer_matches_legacy_parser():
+    for line in generate_lines(5000):
+        parsed = parse_line(line)
+        assert ((parsed.description, get_task_data(parsed))
+                == legacy_parse_line(line))
+
+
+def make_taskw(tmp_path):
+    makedirs(tmp_path / "data")
+    return FakeTaskWarrior(str(tmp_path / "data"))
+
+
+def get_pending(taskw):
+    return taskw.load_tasks("pending")["pending"]
+
+
+def test_repeated_line_replaces_staged_record(tmp_path):
+    # Like importing the two lines in separate runs
+    taskw = make_taskw(tmp_path)
+    assert parse_todos(taskw, ["foo @a +p", "foo"]) == []
+
+    (task,) = get_pending(taskw)
+    assert not task.get("tags", None)
+    assert task["project"] == "p"
+
+
+def test_fallback_lines_dont_flush_the_batch(tmp_path):
+    # Unknown attributes go through task_add, the rest stay batched
+    taskw = make_taskw(tmp_path)
+    lines = []
+    for number in range(20):
+        lines.append(f"batched {number}")
+        lines.append(f"fallback {number} category:home")
+
+    assert parse_todos(taskw, lines) == []
+    assert len(get_pending(taskw)) == 40
+    assert taskw.calls["_execute"] == 1
+    assert taskw.calls["task_add"] == 20
@@ -0,0 +1,58 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from os import makedirs
+
+from fakewarrior import FakeTaskWarrior
+from parse import complete_todos, parse_todos
+from taskindex import load_index
+
+
+class SavingTaskWarrior(FakeTaskWarrior):
+    # Every import changes the data files, like Taskwarrior's does
+    def _execute(self, *args):
+        result = super()._execute(*args)
+        self.save()
+        return result
+
+
+def test_batch_created_task_is_found_by_id_next_run(tmp_path):
+    makedirs(tmp_path / "data")
+    taskw = SavingTaskWarrior(str(tmp_path / "data"))
+    taskw.save()
+
+    assert parse_todos(taskw, ["buy milk"]) == []
+    assert parse_todos(taskw, ["buy milk id:1 effort:3"]) == []
+
+    pending = taskw.load_tasks("pending")["pending"]
+    assert [(task["description"], task.get("effort", None))
+            for task in pending] == [("buy milk", 3)]
+
+
+def test_pruned_todo_that_comes_back_is_pending(tmp_path):
+    # The server keeps one index for many imports
+    makedirs(tmp_path / "data")
+    taskw = SavingTaskWarrior(str(tmp_path / "data"))
+    taskw.save()
+    index = load_index(taskw)
+
+    assert parse_todos(taskw, ["fix leak"], index=index) == []
+    assert complete_todos(taskw, ["fix leak"], index=index) == []
+    assert parse_todos(taskw, ["fix leak"], index=index) == []
+
+    pending = taskw.load_tasks("pending")["pending"]
+    assert [task["description"] for task in pending] == ["fix leak"]
+    assert load_index(taskw).get(twi_hash=pending[0]["twi_hash"])
@@ -26,60 +26,289 @@ under certain conditions. See the GNU General Public License v3
 for more details: https://www.gnu.org/licenses/gpl-3.0.en.html
 
 Usage:
-  twinput [options]
+  twinput [options] [REPO...]
 
 Options:
   -h, --help                     Show this screen.
   -e EDITOR, --editor=EDITOR     Select editor for use with TWInput.
-  -f FILE, --file=FILE           Read input from file.
+  -f FILE, --file=FILE           Read input from file ("-" for stdin).
   -g, --gitgrep                  Parse TODOs in this Git repository.
   -i, --interactive              Iterate through each task interactively.
+  -j N, --jobs=N                 Repositories to grep at once [default: 8].
+  -n, --dry-run                  Show what would change without writing.
   -o, --orgmode                  Parse Org agenda TODOs into TaskWarrior.
   -p ID, --pomodoro=ID           Start a timer then increment Pomodoro UDA.
+  -r ROOT, --repos=ROOT          Grep every repository with a .twparse
+                                 below ROOT (as well as any REPO given).
   -s, --someday                  Show only someday tasks in interactive.
   -t MIN, --time=MIN             Set the time (in minutes) for a timer.
+  -w, --watch                    Import what each save adds to the -f file,
+                                 or to the editor's file until it closes.
+  --connect                      Import through the twinput server when
+                                 it's running.
   --debug                        Pause to allow connecting a debugger.
+  --detach                       Run the --pomodoro timer in the daemon.
+  --pom-daemon                   Run your timers in the background.
+  --pom-status                   List the timers the daemon is running.
+  --pom-stop                     Stop the --pomodoro timer in the daemon.
+  --profile                      Print where the time went when done.
+  --profile-json=FILE            Append the timings to FILE as JSON lines.
+  --prune                        Complete tasks whose TODO comment is gone.
+  --rescan                       Grep the whole tree, not just changed files.
+  --serve                        Keep Taskwarrior state warm for --connect.
   --version                      Show the current version.
 """
 
+# Only what every run needs is imported up front. Each mode imports its
+# own modules when it starts, and Taskwarrior is only loaded once something
+# asks for it, so --help, --version and the socket clients start quickly.
 from docopt import docopt
-from curses import wrapper
-from os import environ, getcwd
-from taskw import TaskWarrior
-from taskw.exceptions import TaskwarriorError
+from os import environ, getcwd, path, unlink
+from atexit import register
+from itertools import chain, islice
+from sys import argv, exit, modules, stderr, stdin
 
-from buffer import get_header, get_fail_message, open_file_buffer
-from parse import git_grep_todos, parse_todos, read_pim
-from interactive import interactive
-from pomodoro import timer
+from buffer import (get_header, get_fail_message, open_file_buffer,
+                    start_file_buffer)
+from remote import (LINES_PER_REQUEST, send_command, send_request,
+                    server_running)
 
 # Get the system editor, defaulting to Vim
 EDITOR = environ.get("EDITOR", "vim")
 VERSION = "TaskWarrior Input 1.3.0"
 
-# Load TaskWarrior
-taskw = TaskWarrior()
+DRY_RUN = False
+CONNECT = False
 
+# Loaded by get_taskw()
+TASKW = None
 
-def get_direct_input():
-    failed = None
-    while True:
+# Hashes of the lines applied so far, so the editor's retry rounds (and
+# --watch's saves) only commit what's new or edited. Input that's never
+# retried isn't hashed, so it streams through in flat memory.
+APPLIED = set()
+
+
+def get_taskw():
+    global TASKW
+    if TASKW is None:
+        from taskw import TaskWarrior
+        from taskdata import load_backend
+        TASKW = load_backend(TaskWarrior())
+
+    return TASKW
+
+
+def print_plan(action, line):
+    if action == "applied":
+        print(f"{'skipped':<10} {line}    (already applied)")
+    else:
+        print(f"{action:<10} {line}")
+
+
+def report_applied(action, line):
+    # Outside of a dry run, only the skipped lines are worth a mention
+    if action == "applied":
+        print_plan(action, line)
+
+
+def import_todos(lines, applied=None):
+    failed = []
+    if CONNECT:
+        # Sent a request at a time, so piped input is never held whole
+        if isinstance(lines, str):
+            lines = lines.split("\n")
+        lines = iter(lines)
+        while True:
+            chunk = [line.rstrip("\n")
+                     for line in islice(lines, LINES_PER_REQUEST)]
+            if not chunk:
+                return failed
+
+            chunk_failed = remote_import({"source": "lines", "lines": chunk},
+                                         applied)
+            if chunk_failed is None:
+                # The server's gone, the rest is imported here
+                lines = chain(chunk, lines)
+                break
+            failed += chunk_failed
+
+    from parse import parse_todos
+    if not DRY_RUN:
+        return failed + parse_todos(get_taskw(), lines, report=report_applied,
+                                    applied=applied)
+
+    for line, msg in parse_todos(get_taskw(), lines, dry_run=True,
+                                 report=print_plan, applied=applied):
+        print(f"{'failed':<10} {line}    ERROR: {msg}")
+
+    # Nothing was written, so there's nothing to retry in the editor
+    return []
+
+
+def remote_import(request, applied=None):
+    # Have the server harvest and import, then report like a local run.
+    # None means the server is gone and the work is left to this process.
+    global CONNECT
+    request["dry_run"] = DRY_RUN
+    request["applied"] = list(applied) if applied is not None else None
+    try:
+        reply = send_request(request)
+    except (OSError, ValueError):
+        # Stopped since we checked, or hung up without a (whole) reply
+        stderr.write("The twinput server isn't answering, importing "
+                     "without it.\n")
+        CONNECT = False
+        return None
+
+    if "error" in reply:
+        print("Uncaught Taskwarrior Error: " + reply["error"])
+        return []
+
+    if applied is not None:
+        applied.update(reply["applied"])
+
+    for action, line in reply["plan"]:
+        print_plan(action, line)
+    for line in reply["vanished"]:
+        print(f"{'removed':<10} {line}")
+
+    failed = [tuple(failure) for failure in reply["failed"]]
+    if not DRY_RUN:
+        return failed
+
+    for line, msg in failed:
+        print(f"{'failed':<10} {line}    ERROR: {msg}")
+    return []
+
+
+def report_vanished(vanished, prune):
+    for line in vanished:
+        print(f"{'removed':<10} {line}")
+
+    if not prune or DRY_RUN:
+        return []
+
+    from parse import complete_todos
+    return complete_todos(get_taskw(), vanished)
+
+
+def retry_in_editor(failed):
+    # Until every line has gone in or been left commented out
+    while failed:
         initial_message = get_header(VERSION) + get_fail_message(failed)
         to_parse = open_file_buffer(initial_message, editor=EDITOR)
-        failed = parse_todos(taskw, to_parse)
-        if not failed:
-            break
+        failed = import_todos(to_parse, applied=APPLIED)
+
+
+def get_direct_input():
+    to_parse = open_file_buffer(get_header(VERSION), editor=EDITOR)
+    retry_in_editor(import_todos(to_parse, applied=APPLIED))
 
 
 def read_from_file(filename):
+    if filename == "-":
+        # Piped input has no terminal to reopen the editor on, so just
+        # report the lines that failed.
+        failed = import_todos(stdin)
+        if failed:
+            stderr.write(get_fail_message(failed).decode("utf-8"))
+            exit(1)
+        return
+
     with open(filename, 'r') as infile:
-        to_parse = infile.read()
+        retry_in_editor(import_todos(infile))
 
-    failed = parse_todos(taskw, to_parse)
-    while failed:
-        initial_message = get_header(VERSION) + get_fail_message(failed)
-        to_parse = open_file_buffer(initial_message, editor=EDITOR)
-        failed = parse_todos(taskw, to_parse)
+
+def import_saved(lines):
+    # Nothing to retry in, the lines stay in the file to be edited
+    failed = import_todos(lines, applied=APPLIED)
+    if failed:
+        stderr.write(get_fail_message(failed).decode("utf-8"))
+        stderr.flush()
+
+
+def watch_input(filename):
+    from watch import watch
+    if filename == "-":
+        print("--watch needs a file to watch, not stdin.")
+    elif filename:
+        print(f"Watching {filename} (Ctrl-C to stop)")
+        watch(filename, import_saved)
+    else:
+        file_path, editor = start_file_buffer(get_header(VERSION),
+                                              editor=EDITOR)
+        try:
+            watch(file_path, import_saved, editor=editor)
+        finally:
+            unlink(file_path)
+
+
+def harvest_git(arguments, vanished, scans):
+    from parse import find_repos, git_grep_repos, git_grep_todos
+    repos = list(arguments["REPO"])
+    if arguments["--repos"]:
+        repos += find_repos(arguments["--repos"])
+
+    if repos:
+        return git_grep_repos(repos, int(arguments["--jobs"]),
+                              full=arguments["--rescan"], vanished=vanished,
+                              dry_run=DRY_RUN, scans=scans)
+    return git_grep_todos(getcwd(), full=arguments["--rescan"],
+                          vanished=vanished, dry_run=DRY_RUN, scans=scans)
+
+
+def run_pomodoro(arguments):
+    from curses import wrapper
+    from taskw.exceptions import TaskwarriorError
+    from pomodoro import timer
+
+    try:
+        if arguments["--time"]:
+            wrapper(timer,
+                    int(arguments["--pomodoro"]),
+                    float(arguments["--time"]))
+        else:
+            wrapper(timer, int(arguments["--pomodoro"]))
+    except (ValueError, TaskwarriorError):
+        print("Argument to --pomodoro must be a valid task ID.")
+    except KeyboardInterrupt:
+        print("Clock interrupted. Pomodoro not counted.")
+
+
+def run_interactive(someday):
+    from curses import wrapper
+    from interactive import interactive
+
+    for error in wrapper(interactive, someday) or []:
+        print(error)
+
+
+def report_profile(arguments):
+    from instrument import report, write_json
+    if arguments["--profile"]:
+        report()
+    if arguments["--profile-json"]:
+        write_json(arguments["--profile-json"], argv[1:])
+
+
+def control_pomodoro(arguments):
+    if arguments["--pom-status"]:
+        words = ["status"]
+    elif not arguments["--pomodoro"]:
+        print("--pom-stop needs the task's ID given with --pomodoro.")
+        return
+    elif arguments["--pom-stop"]:
+        words = ["stop", arguments["--pomodoro"]]
+    else:
+        words = ["start", arguments["--pomodoro"],
+                 arguments["--time"] or "25"]
+
+    try:
+        print(send_command(*words), end="")
+    except OSError:
+        print("The pomodoro daemon isn't running, start it with "
+              "--pom-daemon.")
 
 
 if __name__ == "__main__":
@@ -88,54 +317,88 @@ if __name__ == "__main__":
     if arguments["--debug"]:
         input("Press [ENTER] to continue...")
 
+    if arguments["--profile"] or arguments["--profile-json"]:
+        # Before any mode has imported what it's going to time
+        from instrument import enable
+        enable()
+        register(report_profile, arguments)
+
     if arguments["--editor"]:
         EDITOR = arguments["--editor"]
 
+    DRY_RUN = arguments["--dry-run"]
+    CONNECT = arguments["--connect"] and server_running()
+
     try:
-        if arguments["--gitgrep"]:
-            grepd = git_grep_todos(getcwd())
-            failed = parse_todos(taskw, grepd)
-            while failed:
-                initial_message = (get_header(VERSION)
-                                   + get_fail_message(failed))
-                to_parse = open_file_buffer(initial_message,
-                                            editor=EDITOR)
-                failed = parse_todos(taskw, to_parse)
+        if arguments["--serve"]:
+            from server import run_server
+            run_server()
+        elif arguments["--gitgrep"]:
+            failed = None
+            if CONNECT:
+                failed = remote_import({
+                    "source": "gitgrep",
+                    "repos": [path.abspath(repo)
+                              for repo in arguments["REPO"]],
+                    "root": arguments["--repos"]
+                    and path.abspath(arguments["--repos"]),
+                    "jobs": int(arguments["--jobs"]),
+                    "cwd": getcwd(),
+                    "full": arguments["--rescan"],
+                    "prune": arguments["--prune"]})
+            if failed is None:
+                from parse import save_git_scans
+                vanished = []
+                scans = []
+                failed = import_todos(harvest_git(arguments, vanished,
+                                                  scans))
+                failed += report_vanished(vanished, arguments["--prune"])
+
+                # Anything that failed is harvested again next time
+                if not failed:
+                    save_git_scans(scans)
+            retry_in_editor(failed)
         elif arguments["--interactive"]:
-            if arguments["--someday"]:
-                wrapper(interactive, True)
-            else:
-                wrapper(interactive, False)
+            run_interactive(arguments["--someday"])
         elif arguments["--orgmode"]:
             try:
                 pim_dir = environ["pim"]
-                pim = read_pim(pim_dir)
-                failed = parse_todos(taskw, pim)
-                while failed:
-                    initial_message = (get_header(VERSION)
-                                       + get_fail_message(failed))
-                    to_parse = open_file_buffer(initial_message,
-                                                editor=EDITOR)
-                    failed = parse_todos(taskw, to_parse)
+                failed = None
+                if CONNECT:
+                    failed = remote_import({"source": "orgmode",
+                                            "pim": path.abspath(pim_dir)})
+                if failed is None:
+                    from parse import mark_org_todos, read_pim
+
+                    # Only headlines that went in are marked TASKED
+                    marks = None if DRY_RUN else []
+                    failed = import_todos(read_pim(pim_dir, marks))
+                    if marks:
+                        mark_org_todos(marks, failed)
+                retry_in_editor(failed)
             except KeyError:
                 print("\n$pim environment variable is not set.\n")
+        elif arguments["--pom-daemon"]:
+            from pomodoro import run_daemon
+            run_daemon()
+        elif (arguments["--pom-status"] or arguments["--pom-stop"]
+              or arguments["--pomodoro"] and arguments["--detach"]):
+            control_pomodoro(arguments)
         elif arguments["--pomodoro"]:
-            try:
-                if arguments["--time"]:
-                    wrapper(timer,
-                            int(arguments["--pomodoro"]),
-                            float(arguments["--time"]))
-                else:
-                    wrapper(timer, int(arguments["--pomodoro"]))
-            except (ValueError, TaskwarriorError):
-                print("Argument to --pomodoro must be a valid task ID.")
-            except KeyboardInterrupt:
-                print("Clock interrupted. Pomodoro not counted.")
+            run_pomodoro(arguments)
+        elif arguments["--watch"]:
+            watch_input(arguments["--file"])
         elif arguments["--file"]:
             read_from_file(arguments["--file"])
         else:
             get_direct_input()
 
-    except TaskwarriorError as err:
+    except Exception as err:
+        # Only a mode that loaded taskw can have raised its error
+        exceptions = modules.get("taskw.exceptions", None)
+        if not exceptions or not isinstance(err,
+                                            exceptions.TaskwarriorError):
+            raise
+
         msg = err.stderr.decode("utf-8").split("\n")[-1]
         print("Uncaught Taskwarrior Error: " + msg)
@@ -0,0 +1,181 @@
+# Copyright (C) 2018 Robert Herschel Hawk
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from collections import Counter
+from ctypes import CDLL
+from ctypes.util import find_library
+from os import close, path, read, stat
+from select import select
+from struct import calcsize, unpack_from
+from time import monotonic, sleep
+
+# From <sys/inotify.h>. Editors either write the file in place or write a
+# new one and rename it over the old, so the directory is watched for both.
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = "iIII"
+INOTIFY_EVENT_SIZE = calcsize(INOTIFY_EVENT)
+
+# How often to look at the file without inotify, or at the editor with it
+POLL_INTERVAL = 0.5
+
+# Editors often save in a few steps, so wait for them to finish
+SETTLE_TIME = 0.05
+
+# An editor that exits sooner than this has most likely handed the file to
+# a GUI window that's still open
+EDITOR_DETACH_TIME = 2
+
+
+def open_inotify(file_path):
+    try:
+        libc = CDLL(find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (AttributeError, OSError):
+        return None
+    if fd < 0:
+        return None
+
+    directory = path.dirname(path.abspath(file_path)).encode()
+    if libc.inotify_add_watch(fd, directory,
+                              IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+        close(fd)
+        return None
+
+    return fd
+
+
+def read_events(fd):
+    # Names of the files in the watched directory that were saved
+    names = set()
+    try:
+        data = read(fd, 64 * 1024)
+    except BlockingIOError:
+        return names
+
+    offset = 0
+    while offset < len(data):
+        _, _, _, length = unpack_from(INOTIFY_EVENT, data, offset)
+        offset += INOTIFY_EVENT_SIZE
+        names.add(data[offset:offset + length].rstrip(b"\0").decode(
+            errors="replace"))
+        offset += length
+
+    return names
+
+
+def get_file_signature(file_path):
+    try:
+        info = stat(file_path)
+    except OSError:
+        return None
+    return info.st_mtime_ns, info.st_size
+
+
+class FileWatcher:
+    # Waits for a file to be saved, with inotify where there is one and by
+    # polling its mtime and size where there isn't.
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self.name = path.basename(file_path)
+        self.fd = open_inotify(file_path)
+        self.signature = get_file_signature(file_path)
+
+    def wait(self, timeout=POLL_INTERVAL):
+        # True once the file might have changed, False on a timeout
+        if self.fd is None:
+            sleep(timeout)
+            signature = get_file_signature(self.file_path)
+            changed = signature != self.signature
+            self.signature = signature
+            return changed
+
+        deadline = monotonic() + timeout
+        while True:
+            ready = select([self.fd], [], [], max(deadline - monotonic(), 0))
+            if not ready[0]:
+                return False
+            if self.name in read_events(self.fd):
+                break
+
+        sleep(SETTLE_TIME)
+        read_events(self.fd)
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            close(self.fd)
+            self.fd = None
+
+
+def read_lines(file_path):
+    try:
+        with open(file_path, "r") as infile:
+            return infile.read().split("\n")
+    except OSError:
+        # Caught between an editor's write and its rename
+        return None
+
+
+def get_added_lines(previous, current):
+    # Lines that weren't there last time, in the order they're in now. An
+    # edited line is a new line, and a line that was there before doesn't
+    # count again for being moved.
+    seen = Counter(previous)
+    added = []
+    for line in current:
+        if seen[line]:
+            seen[line] -= 1
+        else:
+            added.append(line)
+
+    return added
+
+
+def editor_exited(editor, started):
+    return (editor is not None and editor.poll() is not None
+            and monotonic() - started > EDITOR_DETACH_TIME)
+
+
+def watch(file_path, import_lines, editor=None):
+    # Import what each save of file_path added until interrupted, or until
+    # the (terminal) editor given exits. Whatever is in the file already
+    # counts as added.
+    watcher = FileWatcher(file_path)
+    started = monotonic()
+    previous = []
+    try:
+        while True:
+            # Read once more after the editor exits, for its last save
+            current = read_lines(file_path)
+            if current is not None and current != previous:
+                added = get_added_lines(previous, current)
+                previous = current
+                # Blank and comment lines don't need Taskwarrior loading
+                if any(line[:1] not in ("", "#") for line in added):
+                    import_lines(added)
+
+            if editor_exited(editor, started):
+                break
+            while not watcher.wait():
+                if editor_exited(editor, started):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()